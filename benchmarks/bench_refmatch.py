@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+BENCH_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
+TEST_DATA_TAR = BENCH_DIR / ".." / "tests" / "xref_tool_test_data.tar.bz2"
+
+sys.path.insert(0, str(BENCH_DIR / ".."))
+import xrefdb  # noqa: E402
+
+################################################################################
+
+# Reference matching as xrefdb.py originally did it: the patterns are
+# compiled on each call, and every line runs through both patterns
+
+
+def legacy_match_referenced_sha(line):
+    RE_REVERT_SHA = re.compile(
+        r'.*[Rr]evert.{0,10}commit.*\s+(?P<sha>[0-9a-f]{5,40})\b')
+    RE_FIXES_SHA = re.compile(
+        r'.*[Ff]ixes.{0,10}\s+(?P<sha>[0-9a-f]{5,40})\b')
+    refsha = ""
+    match = RE_REVERT_SHA.match(line)
+    if not match:
+        match = RE_FIXES_SHA.match(line)
+    if match:
+        refsha = match.group('sha')
+    return refsha
+
+
+def legacy_match_upstream_sha(message):
+    RE_UPSTREAM_1 = re.compile(xrefdb.RE_UPSTREAM_1.pattern, re.MULTILINE)
+    RE_UPSTREAM_2 = re.compile(xrefdb.RE_UPSTREAM_2.pattern, re.MULTILINE)
+    match = RE_UPSTREAM_1.search(message)
+    if not match:
+        match = RE_UPSTREAM_2.search(message)
+    if match:
+        return match.group('sha')
+    return ""
+
+
+def legacy_parse(messages):
+    return [([legacy_match_referenced_sha(line)
+              for line in message.splitlines()],
+             legacy_match_upstream_sha(message))
+            for message in messages]
+
+
+def parse(messages):
+    return [([xrefdb.match_referenced_sha(line)
+              for line in message.splitlines()],
+             xrefdb.match_upstream_sha(message))
+            for message in messages]
+
+################################################################################
+
+
+def read_messages(gitdir, rev):
+    cmd = ['git', '--git-dir', gitdir, 'log', '-z', '--format=%B', rev]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    return [m for m in out.decode('utf-8', 'replace').split('\0') if m]
+
+
+def bench(name, func, messages, repeat):
+    secs = min(timeit.repeat(lambda: func(messages), number=1, repeat=repeat))
+    print("%-10s %8.3f s  %10.0f commits/s" % (
+        name, secs, len(messages) / secs))
+    return secs
+
+
+def getargs():
+    desc = \
+        "Micro-benchmark for the commit message matching in xrefdb.py. "\
+        "Compares the precompiled patterns with substring pre-filters "\
+        "against the original per-line pattern compilation on the "\
+        "commit messages in revision range REV."
+
+    epil = "Example: ./%s --git-dir ~/linux-stable v4.19^..v4.19.110" % \
+        os.path.basename(__file__)
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    help = "revision range to read the commit messages from, "\
+           "default is 'v4.19^..v4.19.10'"
+    parser.add_argument('REV', nargs='?', help=help, default='v4.19^..v4.19.10')
+
+    help = "file path to git repository, defaults to the repository "\
+           "in the test data"
+    parser.add_argument('--git-dir', nargs='?', help=help)
+
+    help = "number of timed repetitions, default is 5"
+    parser.add_argument('--repeat', type=int, help=help, default=5)
+
+    return parser.parse_args()
+
+################################################################################
+
+
+if __name__ == "__main__":
+    args = getargs()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gitdir = args.git_dir
+        if not gitdir:
+            subprocess.run(
+                ["tar", "-xjf", TEST_DATA_TAR, "--directory", tmpdir],
+                check=True)
+            gitdir = os.path.join(
+                tmpdir, "xref_tool_test_data", "v4.19.10", ".git")
+        messages = read_messages(gitdir, args.REV)
+
+    print("[+] Matching references in %d commit messages" % len(messages))
+    if parse(messages) != legacy_parse(messages):
+        sys.stderr.write("Error: results differ from the original matching\n")
+        sys.exit(1)
+    legacy = bench("original", legacy_parse, messages, args.repeat)
+    current = bench("current", parse, messages, args.repeat)
+    print("[+] Speedup: %.1fx" % (legacy / current))
+
+################################################################################
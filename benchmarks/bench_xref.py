@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(os.path.dirname(os.path.realpath(__file__)))
+BASELINE = BENCH_DIR / "baseline.json"
+
+sys.path.insert(0, str(BENCH_DIR / ".."))
+import xrefdb  # noqa: E402
+import xrefmissing  # noqa: E402
+import synthrepo  # noqa: E402
+
+################################################################################
+
+# Revision ranges of the synthetic repositories, see synthrepo.SynthRepo
+STABLE_REV = "v1.0^..linux-1.0.y"
+MAINLINE_REV = "v1.0^..master"
+
+# Scripts whose startup time is benchmarked, see bench_startup()
+SCRIPTS = [
+    "xrefdb.py", "xrefmissing.py", "xrefquery.py", "find-missing-commits.py",
+]
+
+# Timings are only reported as regressions if they are also this many
+# seconds slower than the baseline: the shortest ones are mostly noise
+MIN_REGRESSION = 0.05
+
+################################################################################
+
+
+def timed(results, name, repeat, func, *args):
+    # Run func(*args) 'repeat' times, record the fastest run as 'name' in
+    # 'results', and return the result of the last run
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    results[name] = best
+    print("%-36s %9.3f s" % (name, best))
+    return ret
+
+
+def bench(gitdir, workdir, repeat):
+    # The scripts import their dependencies on first use: import them
+    # before the timed runs
+    for module in [xrefdb.git, xrefmissing.np, xrefmissing.pd]:
+        module.__name__
+
+    results = {}
+    stable = timed(results, "XrefDb stable", repeat,
+                   xrefdb.XrefDb, gitdir, STABLE_REV)
+    mainline = timed(results, "XrefDb mainline", repeat,
+                     xrefdb.XrefDb, gitdir, MAINLINE_REV)
+    timed(results, "find_references mainline", repeat,
+          lambda: sum(1 for _ in mainline.find_references()))
+
+    stable_csv = workdir / "stable.csv"
+    mainline_csv = workdir / "mainline.csv"
+    stable.to_csv(stable_csv)
+    timed(results, "to_csv mainline", repeat, mainline.to_csv, mainline_csv)
+
+    left = timed(results, "load_db stable", repeat,
+                 xrefmissing.load_db, stable_csv)
+    right = timed(results, "load_db mainline", repeat,
+                  xrefmissing.load_db, mainline_csv)
+    for mode, col in xrefmissing.MODES.items():
+        df = timed(results, "missing_fixes_based_on %s" % mode, repeat,
+                   xrefmissing.missing_fixes_based_on, left, col, right)
+        print("%-36s %9d rows" % ("", len(df)))
+    return results
+
+
+def bench_startup(repeat):
+    # Time printing the help of each script: the scripts import their heavy
+    # dependencies only when they need them, so this is mostly the time
+    # the interpreter takes to start
+    results = {}
+    for script in SCRIPTS:
+        cmd = [sys.executable, str(BENCH_DIR / ".." / script), "-h"]
+        timed(results, "startup %s" % script, repeat,
+              lambda: subprocess.run(
+                  cmd, stdout=subprocess.DEVNULL, check=True))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Return the names of the results slower than 'tolerance' times the
+    # baseline
+    regressions = []
+    for name, secs in results.items():
+        base = baseline.get(name)
+        if base is not None and secs > base * tolerance and \
+                secs > base + MIN_REGRESSION:
+            print("[+] Regression: %s took %.3f s, baseline is %.3f s" % (
+                name, secs, base))
+            regressions.append(name)
+    return regressions
+
+
+def getargs():
+    desc = \
+        "Benchmark xrefdb.py and xrefmissing.py on synthetic kernel-like "\
+        "repositories generated with synthrepo.py: builds the databases of "\
+        "the stable and mainline branches, writes and loads them, and "\
+        "compares them. The startup time of each script is measured too. "\
+        "The timings are compared to the baseline numbers "\
+        "stored in BASELINE, which are specific to the machine they were "\
+        "measured on: save a new baseline with --save-baseline before "\
+        "comparing changes on another machine."
+
+    epil = "Example: ./%s --commits 10000 100000 --work-dir /tmp/bench" % \
+        os.path.basename(__file__)
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    help = "numbers of mainline commits in the benchmarked repositories, "\
+           "default is 10000"
+    parser.add_argument(
+        '--commits', type=int, nargs='+', help=help, default=[10000])
+
+    help = "directory for the generated repositories and databases; "\
+           "repositories found there are reused. Defaults to a temporary "\
+           "directory"
+    parser.add_argument('--work-dir', nargs='?', help=help)
+
+    help = "number of timed repetitions, default is 1"
+    parser.add_argument('--repeat', type=int, help=help, default=1)
+
+    help = "baseline file, default is '%s'" % BASELINE.name
+    parser.add_argument('--baseline', nargs='?', help=help, default=BASELINE)
+
+    help = "store the timings in the baseline file instead of comparing "\
+           "them to it"
+    parser.add_argument('--save-baseline', action='store_true', help=help)
+
+    help = "report a regression if a timing is more than TOLERANCE times "\
+           "the baseline, default is 1.5"
+    parser.add_argument('--tolerance', type=float, help=help, default=1.5)
+
+    return parser.parse_args()
+
+################################################################################
+
+
+if __name__ == "__main__":
+    args = getargs()
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = Path(args.work_dir or tmpdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+        regressions = []
+        print("[+] Benchmarking script startup")
+        results = bench_startup(args.repeat)
+        if args.save_baseline:
+            baseline["startup"] = results
+        else:
+            regressions += compare(
+                results, baseline.get("startup", {}), args.tolerance)
+        for commits in args.commits:
+            gitdir = workdir / ("synth-%d.git" % commits)
+            if not gitdir.exists():
+                print("[+] Generating repository with %d commits" % commits)
+                synthrepo.generate(gitdir, commits)
+            print("[+] Benchmarking %s" % gitdir)
+            results = bench(gitdir, workdir, args.repeat)
+            if args.save_baseline:
+                baseline[str(commits)] = results
+            else:
+                regressions += compare(
+                    results, baseline.get(str(commits), {}), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print("[+] Wrote baseline: %s" % args.baseline)
+    elif regressions:
+        sys.exit(1)
+
+################################################################################
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import argparse
+import hashlib
+import os
+import random
+import subprocess
+import sys
+
+################################################################################
+
+# The commits have no file content: all of them point to the empty tree,
+# which keeps the generated repositories small and fast to write
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+IDENT = "Synthetic Developer <dev@example.com>"
+START_TIME = 1500000000
+
+SUBSYSTEMS = [
+    "mm", "net", "sched", "x86/mm", "ALSA: hda", "drm/i915", "ext4", "btrfs",
+    "tracing", "KVM: x86", "usb: dwc3", "bpf", "crypto", "iommu", "nvme",
+]
+VERBS = [
+    "fix", "add", "remove", "avoid", "handle", "check", "use", "simplify",
+]
+OBJECTS = [
+    "NULL pointer dereference", "use-after-free", "memory leak", "race",
+    "reference count", "error path", "locking", "overflow check",
+    "uninitialized variable", "off-by-one", "timeout", "return value",
+]
+
+################################################################################
+
+
+class SynthRepo:
+    # Writes a synthetic kernel-like history as a 'git fast-import' stream:
+    # a mainline branch 'master' tagged 'v1.0' half-way, and a stable branch
+    # 'linux-1.0.y' forked from 'v1.0' that backports a part of the later
+    # mainline commits with "commit SHA upstream." lines, tagged 'v1.0.N'.
+    # Mainline commits carry Fixes: tags and reverts of earlier commits.
+
+    def __init__(self, commits, seed=0, fixes_rate=0.15, revert_rate=0.01,
+                 backport_rate=0.2):
+        self.commits = commits
+        self.random = random.Random(seed)
+        self.fixes_rate = fixes_rate
+        self.revert_rate = revert_rate
+        self.backport_rate = backport_rate
+        self.time = START_TIME
+        self.mark = 0
+        # Mainline commits as (sha, mark, summary)
+        self.mainline = []
+        # Key: commit sha, Value: commit message
+        self.messages = {}
+
+    def write(self, out):
+        release = self.commits // 2
+        parent = None
+        for i in range(self.commits):
+            summary, message = self._mainline_message()
+            sha = self._commit(out, "refs/heads/master", message, parent)
+            parent = (sha, self.mark)
+            self.mainline.append((sha, self.mark, summary))
+            if i == release:
+                self._tag(out, "v1.0", self.mark)
+
+        # Stable branch: backport commits made after the release
+        parent = self.mainline[release][:2]
+        stable = 0
+        for sha, _, summary in self.mainline[release + 1:]:
+            if self.random.random() >= self.backport_rate:
+                continue
+            message = self.messages[sha].replace(
+                "\n\n", "\n\ncommit %s upstream.\n\n" % sha, 1)
+            parent = (self._commit(
+                out, "refs/heads/linux-1.0.y", message, parent), self.mark)
+            stable += 1
+            if stable % 100 == 0:
+                self._tag(out, "v1.0.%d" % (stable // 100), self.mark)
+
+    def _summary(self):
+        return "%s: %s %s" % (
+            self.random.choice(SUBSYSTEMS), self.random.choice(VERBS),
+            self.random.choice(OBJECTS))
+
+    def _mainline_message(self):
+        trailers = []
+        if self.mainline and self.random.random() < self.revert_rate:
+            sha, _, summary = self._recent_commit()
+            summary = 'Revert "%s"' % summary
+            body = "This reverts commit %s.\n" % sha
+        else:
+            summary = self._summary()
+            body = "Some explanation of the change.\n"
+            if self.mainline and self.random.random() < self.fixes_rate:
+                sha, _, fixed = self._recent_commit()
+                trailers.append('Fixes: %s ("%s")' % (sha[:12], fixed))
+        trailers.append("Signed-off-by: %s" % IDENT)
+        message = "%s\n\n%s\n%s\n" % (summary, body, "\n".join(trailers))
+        return summary, message
+
+    def _recent_commit(self):
+        # Fixes usually reference fairly recent commits
+        back = int(self.random.expovariate(1 / 500)) + 1
+        back = min(len(self.mainline), back)
+        return self.mainline[-back]
+
+    def _commit(self, out, ref, message, parent):
+        self.mark += 1
+        self.time += 60
+        ident = "%s %d +0000" % (IDENT, self.time)
+        data = message.encode('utf-8')
+        out.write(b"commit %s\nmark :%d\n" % (ref.encode(), self.mark))
+        out.write(b"author %s\ncommitter %s\n" % (
+            ident.encode(), ident.encode()))
+        out.write(b"data %d\n%s\n" % (len(data), data))
+        if parent:
+            out.write(b"from :%d\n" % parent[1])
+        else:
+            out.write(b"deleteall\n")
+        out.write(b"\n")
+        sha = commit_sha(parent[0] if parent else None, ident, data)
+        self.messages[sha] = message
+        return sha
+
+    def _tag(self, out, name, mark):
+        out.write(b"reset refs/tags/%s\nfrom :%d\n\n" % (name.encode(), mark))
+
+
+def commit_sha(parent, ident, data):
+    # Return the sha of the commit object fast-import writes for a commit
+    # on the empty tree
+    obj = b"tree %s\n" % EMPTY_TREE.encode()
+    if parent:
+        obj += b"parent %s\n" % parent.encode()
+    obj += b"author %s\ncommitter %s\n\n" % (ident.encode(), ident.encode())
+    obj += data
+    return hashlib.sha1(b"commit %d\0" % len(obj) + obj).hexdigest()
+
+
+def generate(path, commits, seed=0):
+    # Create git repository 'path' with a synthetic history of 'commits'
+    # mainline commits, see SynthRepo
+    subprocess.run(["git", "init", "-q", "--bare", path], check=True)
+    pipe = subprocess.Popen(
+        ["git", "--git-dir", path, "fast-import", "--quiet"],
+        stdin=subprocess.PIPE)
+    synth = SynthRepo(commits, seed)
+    synth.write(pipe.stdin)
+    pipe.stdin.close()
+    if pipe.wait() != 0:
+        raise ValueError("git fast-import failed")
+    # Check that the shas referenced in the messages are the real ones
+    tip = subprocess.run(
+        ["git", "--git-dir", path, "rev-parse", "master"],
+        stdout=subprocess.PIPE, check=True, encoding='utf-8').stdout.strip()
+    if tip != synth.mainline[-1][0]:
+        raise ValueError("unexpected commit sha %s" % tip)
+    return synth
+
+
+def getargs():
+    desc = \
+        "Generate a synthetic kernel-like git repository for benchmarking: "\
+        "mainline branch 'master' with Fixes: tags and reverts, tagged "\
+        "'v1.0' half-way, and stable branch 'linux-1.0.y' backporting "\
+        "part of the later mainline commits."
+
+    epil = "Example: ./%s --commits 100000 /tmp/synth.git" % \
+        os.path.basename(__file__)
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    help = "path of the bare git repository to create"
+    parser.add_argument('GIT_DIR', help=help)
+
+    help = "number of mainline commits, default is 10000"
+    parser.add_argument('--commits', type=int, help=help, default=10000)
+
+    help = "random seed, default is 0"
+    parser.add_argument('--seed', type=int, help=help, default=0)
+
+    return parser.parse_args()
+
+################################################################################
+
+
+if __name__ == "__main__":
+    args = getargs()
+    if os.path.exists(args.GIT_DIR):
+        sys.stderr.write("Error: path exists: %s\n" % args.GIT_DIR)
+        sys.exit(1)
+    generate(args.GIT_DIR, args.commits, args.seed)
+    print("[+] Wrote repository: %s" % args.GIT_DIR)
+
+################################################################################
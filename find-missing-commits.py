@@ -5,9 +5,13 @@
 
 import shutil
 import argparse
+import hashlib
+import importlib
+import json
 import os
 import sys
-import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 import subprocess
 
@@ -55,34 +59,210 @@ def exec_cmd(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
     return stdout
 
 
-def findmissing(dstfolder, lstable, lother):
+def run_after(pool, deps, func, *args):
+    # Submit func(*args) to thread pool 'pool' once all the futures in
+    # 'deps' are done, without occupying a pool worker while waiting.
+    # Returns a Future of the result, which fails if any of 'deps' failed.
+    result = Future()
+    remaining = [len(deps)]
+    lock = threading.Lock()
+
+    def run():
+        try:
+            result.set_result(func(*args))
+        except Exception as e:
+            result.set_exception(e)
+
+    def submit(_dep=None):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        for dep in deps:
+            if dep.exception():
+                result.set_exception(dep.exception())
+                return
+        try:
+            pool.submit(run)
+        except RuntimeError as e:
+            # The pool was shut down after an earlier task failed
+            result.set_exception(e)
+
+    remaining[0] += 1
+    for dep in deps:
+        dep.add_done_callback(submit)
+    submit()
+    return result
+
+
+class TaskPool(ThreadPoolExecutor):
+    # ThreadPoolExecutor that can cancel the tasks not started yet when it
+    # is shut down, like shutdown(cancel_futures=True) of Python 3.9
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.tasks = []
+
+    def submit(self, *args, **kwargs):
+        task = super().submit(*args, **kwargs)
+        self.tasks.append(task)
+        return task
+
+    def shutdown_cancel(self):
+        # Stop accepting new tasks first, so none are added while the
+        # queued ones are cancelled, then wait for the running ones
+        self.shutdown(wait=False)
+        for task in self.tasks:
+            task.cancel()
+        self.shutdown()
+
+
+def import_script(path):
+    # Import the script at 'path' as a module, so that its functions can be
+    # called in-process
+    path = str(path)
+    scriptdir = os.path.dirname(os.path.abspath(path))
+    if scriptdir not in sys.path:
+        sys.path.insert(0, scriptdir)
+    return importlib.import_module(
+        os.path.splitext(os.path.basename(path))[0])
+
+
+class Pipeline:
+    # Runs xrefdb.py and xrefmissing.py in-process: the databases are
+    # passed from the builds to the analyses in memory, and each git
+    # repository is opened once
+
+    def __init__(self, cachedir=None, transitive=False, jobs=1):
+        self.xrefdb = import_script(XREFDB)
+        self.xrefmissing = import_script(XREFMISSING)
+        # Optional directory of earlier builds, see _build_key()
+        self.cachedir = Path(cachedir) if cachedir else None
+        if self.cachedir:
+            self.cachedir.mkdir(parents=True, exist_ok=True)
+        # Include the fixes of the missing commits, see xrefmissing.py
+        self.transitive = transitive
+        # Number of worker processes each build parses the commits in
+        self.jobs = jobs
+        self.version = self._tool_version()
+        # Key: git dir, Value: [GitPython Repo object, Lock]. The lock
+        # serializes the builds sharing the Repo object.
+        self.repos = {}
+        self.lock = threading.Lock()
+
+    def build(self, gitdir, rev, out):
+        # Build the database of revision range 'rev' to file 'out', or load
+        # it from 'out' if it already exists. Returns the database as
+        # loaded by xrefmissing.load_db().
+        if os.path.isfile(out):
+            return self.xrefmissing.load_db(out)
+        cached = None
+        if self.cachedir:
+            cached = self.cachedir / (
+                self._build_key(gitdir, rev) + Path(out).suffix)
+            if cached.is_file():
+                copy_build(cached, out)
+                return self.xrefmissing.load_db(out)
+        repo, lock = self._repo(gitdir)
+        with lock:
+            db = self.xrefdb.XrefDb(gitdir, rev, jobs=self.jobs, repo=repo)
+            # Walk the references once, for both the file and the table
+            rows = list(db.find_references())
+            db.write(out, rows=rows)
+            db.write_meta(out)
+            df = self.xrefmissing.table_from_rows(rows)
+        if cached:
+            copy_build(out, cached)
+        return df
+
+    def analyse(self, stable_db, other_db, blacklist):
+        # Return the commits potentially missing from stable_db based on
+        # commits in other_db
+        df = self.xrefmissing.find_missing(
+            stable_db, other_db, transitive=self.transitive)
+        return self.xrefmissing.remove_blacklisted(df, blacklist)
+
+    def _build_key(self, gitdir, rev):
+        # Return the cache key of the database of revision range 'rev':
+        # the output only changes if the repository, the commits the range
+        # resolves to, or the xrefdb.py version changes
+        repo, lock = self._repo(gitdir)
+        with lock:
+            revshas = self.xrefdb.resolve_rev(repo, rev)
+        key = {
+            'gitdir': os.path.realpath(gitdir),
+            'revshas': revshas,
+            'version': self.version,
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _tool_version(self):
+        # Hash of the sources of the modules that produce the databases
+        sha = hashlib.sha256()
+        for module in [self.xrefdb, importlib.import_module('xrefformat')]:
+            with open(module.__file__, 'rb') as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    def _repo(self, gitdir):
+        with self.lock:
+            if gitdir not in self.repos:
+                self.repos[gitdir] = [
+                    self.xrefdb.git.Repo(gitdir), threading.Lock()]
+            return self.repos[gitdir]
+
+
+def copy_build(src, dst):
+    # Copy database 'src' and its meta file to 'dst', replacing 'dst'
+    # atomically so that concurrent runs never see a partial copy
+    for srcfile, dstfile in [(src, dst), ("%s.meta" % src, "%s.meta" % dst)]:
+        if not os.path.isfile(srcfile):
+            continue
+        tmpfile = "%s.tmp%d" % (dstfile, os.getpid())
+        shutil.copyfile(srcfile, tmpfile)
+        os.replace(tmpfile, dstfile)
+
+
+def findmissing(dstfolder, lstable, lother, jobs=1, cachedir=None,
+                transitive=False):
     dstdir = WORKING_DIR / dstfolder
     dstdir.mkdir(parents=True, exist_ok=True)
-
+    pipeline = Pipeline(cachedir, transitive, jobs)
+
+    # Each database is built once, even if several CHECKLIST items use it,
+    # and each analysis starts as soon as the databases it compares are
+    # built. Up to 'jobs' builds and analyses run at the same time in
+    # threads. The builds from the same repository run one at a time, each
+    # parsing its commits in up to 'jobs' worker processes.
+    pool = TaskPool(max_workers=jobs)
+    builds = {}
+    analyses = []
     for item in CHECKLIST:
-        stable_out = dstdir / item['stable_out']
-        other_out = dstdir / item['other_out']
-        missing_out = dstdir / item['missing_out']
-        blacklist = item['blacklist']
-        blacklist_opt = ("--blacklist %s" % blacklist) if blacklist else ""
-
-        if not os.path.isfile(stable_out):
-            cmd = "%s --git-dir %s --out %s %s" % (
-                XREFDB, lstable, stable_out, item['stable_rev'])
-            exec_cmd(cmd)
-
-        if not os.path.isfile(other_out):
-            cmd = "%s --git-dir %s --out %s %s" % (
-                XREFDB, lother, other_out, item['other_rev'])
-            exec_cmd(cmd)
-
-        cmd = "%s %s %s --out %s %s" % (
-            XREFMISSING, stable_out, other_out, missing_out, blacklist_opt)
-        ret = exec_cmd(cmd)
-        match = re.search(r'.*(\[\+\].+)', ret, re.MULTILINE | re.DOTALL)
-        if match:
-            print(match.group(1).strip())
-        print("")
+        deps = []
+        for gitdir, rev, out in [
+                (lstable, item['stable_rev'], dstdir / item['stable_out']),
+                (lother, item['other_rev'], dstdir / item['other_out'])]:
+            if out not in builds:
+                builds[out] = run_after(
+                    pool, [], pipeline.build, gitdir, rev, out)
+            deps.append(builds[out])
+        analyses.append(run_after(
+            pool, deps, lambda stable, other, blacklist: pipeline.analyse(
+                stable.result(), other.result(), blacklist),
+            deps[0], deps[1], item['blacklist']))
+
+    # Output the results in CHECKLIST order
+    try:
+        for item, analysis in zip(CHECKLIST, analyses):
+            pipeline.xrefmissing.output(
+                analysis.result(),
+                dstdir / item['stable_out'],
+                dstdir / item['other_out'],
+                dstdir / item['missing_out'])
+            print("")
+    finally:
+        pool.shutdown_cancel()
 
 
 def prompt_if_exists(dstfolder):
@@ -122,7 +302,17 @@ def verify_rev(gitdir, rev):
 
 
 def verify_checklist(stabledir, otherdir, checklist):
+    xrefdb = import_script(XREFDB)
     for item in checklist:
+        for out in [item['stable_out'], item['other_out']]:
+            # A SQLite database holds several branches in one file, which
+            # the build cache and the reuse of existing outputs can't handle
+            if xrefdb.db_format(out) == 'sqlite':
+                sys.stderr.write(
+                    "Error: output \"%s\" is a SQLite database, use csv "
+                    "or npz outputs in CHECKLIST.\n" % out)
+                sys.exit(1)
+
         blacklist = item['blacklist']
         if blacklist and not os.path.isfile(blacklist):
             sys.stderr.write(
@@ -166,7 +356,25 @@ def getargs():
     parser.add_argument(
         '-d', '--dst', nargs='?', help=help, default='./missing_fixes')
 
-    return parser.parse_args()
+    help = "build the databases and compare them for up to JOBS CHECKLIST "\
+           "items at the same time, and read and parse the commits of each "\
+           "database in up to JOBS worker processes, default is 1"
+    parser.add_argument('-j', '--jobs', type=int, help=help, default=1)
+
+    help = "keep a copy of each database built in directory CACHE_DIR, "\
+           "and reuse it on later runs as long as the revision range "\
+           "resolves to the same commits"
+    parser.add_argument('--cache-dir', nargs='?', help=help)
+
+    help = "also report the fixes of the potentially missing commits, "\
+           "see xrefmissing.py --transitive"
+    parser.add_argument('--transitive', action='store_true', help=help)
+
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("argument -j/--jobs: expected a positive integer, "
+                     "got '%d'" % args.jobs)
+    return args
 
 ################################################################################
 
@@ -198,7 +406,8 @@ if __name__ == "__main__":
     prompt_if_exists(dstdir)
     rm_r(dstdir)
     print("[+] Reading commit history, this might take a few minutes")
-    findmissing(dstdir, lstable, lother)
+    findmissing(dstdir, lstable, lother, args.jobs, args.cache_dir,
+                args.transitive)
 
     print("[+] Done, for more details, see: %s" % dstdir.absolute())
 
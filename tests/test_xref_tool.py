@@ -5,6 +5,7 @@
 
 import subprocess
 import os
+import json
 import pytest
 import re
 import shutil
@@ -17,8 +18,16 @@ TEST_DATA_DIR = TESTS_DIR / "xref_tool_test_data"
 TEST_DATA_TAR = TESTS_DIR / "xref_tool_test_data.tar.bz2"
 XREFDB = TESTS_DIR / ".." / "xrefdb.py"
 XREFMISSING = TESTS_DIR / ".." / "xrefmissing.py"
+XREFQUERY = TESTS_DIR / ".." / "xrefquery.py"
 FINDMISSING = TESTS_DIR / ".." / "find-missing-commits.py"
 
+# Modules the scripts must not import to print their help. The startup
+# time itself is measured in benchmarks/bench_xref.py.
+STARTUP_HEAVY_MODULES = ['git', 'numpy', 'pandas', 'tabulate']
+
+sys.path.insert(0, str(TESTS_DIR / ".."))
+import xrefmissing  # noqa: E402
+
 
 @pytest.fixture()
 def set_up_test_data():
@@ -33,12 +42,19 @@ def set_up_test_data():
 
 def test_help():
     """
-    Test help
+    Test help, and that the scripts start up without importing their heavy
+    dependencies
     """
-    cmd = [XREFDB, "-h"]
-    assert subprocess.run(cmd).returncode == 0
-    cmd = [XREFMISSING, "-h"]
-    assert subprocess.run(cmd).returncode == 0
+    for script in [XREFDB, XREFMISSING, XREFQUERY, FINDMISSING]:
+        cmd = [sys.executable, "-X", "importtime", script, "-h"]
+        ret = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            encoding='utf-8')
+        assert ret.returncode == 0
+        imported = re.findall(r'^import time:.*\|\s*(\S+)$', ret.stderr, re.M)
+        for module in STARTUP_HEAVY_MODULES:
+            assert module not in imported, \
+                "%s -h imports %s" % (script.name, module)
 
 
 def test_xrefdb_basic(set_up_test_data):
@@ -79,6 +95,148 @@ def test_xrefdb_none(set_up_test_data):
     assert(lines - 1 == 0)
 
 
+def test_xrefdb_cache(set_up_test_data):
+    """
+    Test that xrefdb.py generates the same output with and without
+    the commit cache
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    cachedir = TEST_DATA_DIR / "cache"
+    outfile = TEST_DATA_DIR / "xrefdb_out.csv"
+    cmd = [XREFDB,
+           "--git-dir", gitdir,
+           "--out", outfile,
+           "v4.19^..v4.19.7"]
+    assert subprocess.run(cmd).returncode == 0
+    expected = open(outfile).read()
+
+    # First run populates the cache, second run reads the commits from it
+    for _ in range(2):
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", outfile,
+               "--cache-dir", cachedir,
+               "v4.19^..v4.19.7"]
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+        assert any(cachedir.iterdir())
+        assert open(outfile).read() == expected
+
+
+def test_xrefdb_jobs(set_up_test_data):
+    """
+    Test that xrefdb.py generates the same output with several jobs as
+    with one job, and rejects less than one job
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outfiles = []
+    for jobs in ["1", "3"]:
+        outfile = TEST_DATA_DIR / ("xrefdb_out_%s.csv" % jobs)
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", outfile,
+               "--jobs", jobs,
+               "v4.19^..v4.19.10"]
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+        outfiles.append(open(outfile).read())
+    assert outfiles[0] == outfiles[1]
+
+    for jobs in ["0", "-3"]:
+        cmd = [XREFDB, "--git-dir", gitdir, "--jobs", jobs, "v4.19^..v4.19.1"]
+        assert subprocess.run(cmd).returncode == 2
+
+
+def test_xrefdb_backend(set_up_test_data):
+    """
+    Test that xrefdb.py generates the same output with both backends
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outfiles = []
+    for backend in ["gitpython", "gitlog"]:
+        outfile = TEST_DATA_DIR / ("xrefdb_out_%s.csv" % backend)
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", outfile,
+               "--backend", backend,
+               "v4.19^..v4.19.10"]
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+        outfiles.append(open(outfile).read())
+    assert outfiles[0] == outfiles[1]
+
+
+def test_xrefdb_batch(set_up_test_data):
+    """
+    Test that xrefdb.py given several REV:OUT pairs generates the same
+    outputs as separate runs, parsing the shared commits only once, and
+    that a single REV containing ':' is taken as a revision
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    revs = ["v4.19^..v4.19.1", "v4.19^..v4.19.7", "v4.19^..v4.19.10"]
+    expected = []
+    for i, rev in enumerate(revs):
+        outfile = TEST_DATA_DIR / ("xrefdb_expected_%d.csv" % i)
+        cmd = [XREFDB, "--git-dir", gitdir, "--out", outfile, rev]
+        assert subprocess.run(cmd).returncode == 0
+        expected.append(open(outfile).read())
+
+    statsfile = TEST_DATA_DIR / "stats.json"
+    cmd = [XREFDB, "--git-dir", gitdir, "--stats-json", statsfile]
+    cmd += ["%s:%s" % (rev, TEST_DATA_DIR / ("xrefdb_out_%d.csv" % i))
+            for i, rev in enumerate(revs)]
+    print(cmd)
+    assert subprocess.run(cmd).returncode == 0
+    for i in range(len(revs)):
+        outfile = TEST_DATA_DIR / ("xrefdb_out_%d.csv" % i)
+        assert open(outfile).read() == expected[i]
+
+    # The last range includes the others: only its commits are parsed
+    cmd = ["git", "--git-dir", gitdir / ".git", "rev-list", "--count",
+           revs[-1]]
+    count = int(subprocess.run(
+        cmd, stdout=subprocess.PIPE, check=True).stdout)
+    phases = json.load(open(statsfile))['phases']
+    parse = next(p for p in phases if p['name'] == 'parse commits')
+    assert parse['counts']['parsed'] == count
+
+    outfile = TEST_DATA_DIR / "xrefdb_out.csv"
+    cmd = [XREFDB, "--git-dir", gitdir, "--out", outfile,
+           "%s:%s" % (revs[0], outfile)]
+    assert subprocess.run(cmd).returncode != 0
+    assert not outfile.exists()
+
+
+def test_xrefdb_update(set_up_test_data):
+    """
+    Test that xrefdb.py --update generates the same output as a full build
+    when the branch moves forward, and when the history is rewritten
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    expected = TEST_DATA_DIR / "xrefdb_expected.csv"
+    cmd = [XREFDB,
+           "--git-dir", gitdir,
+           "--out", expected,
+           "v4.19^..v4.19.7"]
+    assert subprocess.run(cmd).returncode == 0
+
+    outfile = TEST_DATA_DIR / "xrefdb_out.csv"
+    # Tips of branch 'nightly' on consecutive runs: moving the branch back
+    # from v4.19.7 to v4.19.5 rewrites the history, which requires building
+    # the whole range again
+    for tip in ["v4.19.1", "v4.19.6", "v4.19.7", "v4.19.5", "v4.19.7"]:
+        cmd = ["git", "--git-dir", gitdir / ".git",
+               "branch", "-f", "nightly", tip]
+        assert subprocess.run(cmd).returncode == 0
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--update", outfile,
+               "v4.19^..nightly"]
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+    assert open(outfile).read() == open(expected).read()
+
+
 def test_xrefmissing_basic(set_up_test_data):
     """
     Test that xrefmissing.py runs and generates the expected output when
@@ -133,6 +291,346 @@ def test_xrefmissing_basic(set_up_test_data):
     assert(lines - 1 == 2)
 
 
+def test_xrefmissing_npz(set_up_test_data):
+    """
+    Test that xrefmissing.py generates the same output from npz databases
+    as from csv databases
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outfiles = []
+    for ext in ["csv", "npz"]:
+        left = TEST_DATA_DIR / ("left.%s" % ext)
+        right = TEST_DATA_DIR / ("right.%s" % ext)
+        for outfile, rev in [(left, "v4.19^..v4.19.7"),
+                             (right, "v4.19^..v4.19.10")]:
+            cmd = [XREFDB,
+                   "--git-dir", gitdir,
+                   "--out", outfile,
+                   rev]
+            print(cmd)
+            assert subprocess.run(cmd).returncode == 0
+
+        outfile = TEST_DATA_DIR / ("missing_%s.csv" % ext)
+        cmd = [XREFMISSING,
+               left,
+               right,
+               "--out", outfile]
+        assert subprocess.run(cmd).returncode == 0
+        outfiles.append(open(outfile).read())
+    assert outfiles[0] == outfiles[1]
+
+    # Both formats load to the same table, which stores each sha and
+    # each commit summary once
+    tables = [xrefmissing.load_db(TEST_DATA_DIR / ("right.%s" % ext))
+              for ext in ["csv", "npz"]]
+    frames = [table.to_frame() for table in tables]
+    assert frames[0].equals(frames[1])
+    df = frames[0]
+    table = tables[0]
+    shas = set()
+    for col in table.codes:
+        shas.update(df[col].dropna())
+    assert len(table.shas) == len(shas)
+    assert len(table.summary_offsets) - 1 == df['Commit_hexsha'].nunique()
+
+
+def test_xrefmissing_streaming(set_up_test_data):
+    """
+    Test that xrefmissing.py --streaming generates the same output as
+    loading both databases, from csv and npz databases and in any chunk
+    size
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    left = TEST_DATA_DIR / "left.csv"
+    for outfile, rev in [(left, "v4.19^..v4.19.7"),
+                         (TEST_DATA_DIR / "right.csv", "v4.19^..v4.19.10"),
+                         (TEST_DATA_DIR / "right.npz", "v4.19^..v4.19.10")]:
+        cmd = [XREFDB, "--git-dir", gitdir, "--out", outfile, rev]
+        assert subprocess.run(cmd).returncode == 0
+
+    expected = TEST_DATA_DIR / "missing.csv"
+    cmd = [XREFMISSING, left, TEST_DATA_DIR / "right.csv", "--out", expected]
+    assert subprocess.run(cmd).returncode == 0
+    for ext in ["csv", "npz"]:
+        right = TEST_DATA_DIR / ("right.%s" % ext)
+        outfile = TEST_DATA_DIR / ("missing_%s.csv" % ext)
+        cmd = [XREFMISSING, left, right, "--streaming", "--out", outfile]
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+        assert open(outfile).read() == open(expected).read()
+
+        left_db = xrefmissing.load_db(left)
+        df = xrefmissing.find_missing(left_db, xrefmissing.load_db(right))
+        for chunksize in [1, 7, 100000]:
+            assert df.equals(xrefmissing.find_missing_streaming(
+                left_db, right, chunksize=chunksize))
+
+
+def test_xrefmissing_matrix(set_up_test_data):
+    """
+    Test that xrefmissing.py with --left and --right generates the same
+    output for each pair of databases as separate runs, and the summary,
+    comparing a database given twice only once, and rejects --jobs below 1
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    dbs = []
+    for tag in ["v4.19.1", "v4.19.7", "v4.19.10"]:
+        dbs.append(TEST_DATA_DIR / ("%s.csv" % tag))
+        cmd = [XREFDB, "--git-dir", gitdir, "--out", dbs[-1],
+               "v4.19^..%s" % tag]
+        assert subprocess.run(cmd).returncode == 0
+
+    outdir = TEST_DATA_DIR / "matrix"
+    cmd = [XREFMISSING,
+           "--left", dbs[0], dbs[1], dbs[0],
+           "--right", dbs[1], dbs[2],
+           "--out-dir", outdir,
+           "--jobs", "2"]
+    print(cmd)
+    assert subprocess.run(cmd).returncode == 0
+
+    expected = TEST_DATA_DIR / "missing.csv"
+    cmd = [XREFMISSING, dbs[1], dbs[2], "--out", expected]
+    assert subprocess.run(cmd).returncode == 0
+    outfile = outdir / "missing_v4.19.7_v4.19.10.csv"
+    assert open(outfile).read() == open(expected).read()
+
+    summary = open(outdir / "summary.csv").read().splitlines()
+    assert len(summary) == 5
+    assert summary[-1] == '"%s","%s","3"' % (dbs[1], dbs[2])
+
+    for jobs in ["0", "-1"]:
+        cmd = [XREFMISSING, "--left", dbs[0], "--right", dbs[1],
+               "--out-dir", outdir, "--jobs", jobs]
+        assert subprocess.run(cmd).returncode == 2
+
+
+def test_xrefmissing_api(set_up_test_data):
+    """
+    Test that the databases loaded with xrefmissing.load_db() can be used
+    in several comparisons
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    left = TEST_DATA_DIR / "left.csv"
+    right = TEST_DATA_DIR / "right.csv"
+    for outfile, rev in [(left, "v4.19^..v4.19.7"),
+                         (right, "v4.19^..v4.19.10")]:
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", outfile,
+               rev]
+        assert subprocess.run(cmd).returncode == 0
+
+    left_db = xrefmissing.load_db(left)
+    right_db = xrefmissing.load_db(right)
+    df_upstream = xrefmissing.find_missing(left_db, right_db, ['upstream'])
+    df_local = xrefmissing.find_missing(left_db, right_db, ['local'])
+    df = xrefmissing.find_missing(left_db, right_db)
+    assert len(df) == len(df_upstream) + len(df_local) == 3
+    assert xrefmissing.find_missing(left_db, left_db).empty
+    assert xrefmissing.find_missing(right_db, left_db).empty
+
+    # Blacklist entries match the missing commits by sha prefix
+    shas = df['Missing_commit_upstream']
+    blacklist = [shas.iloc[0][:12], shas.iloc[1], shas.iloc[2][1:13]]
+    assert list(xrefmissing.startswith_any(shas, blacklist)) == \
+        [True, True, False]
+
+
+def make_db(rows):
+    # Return a database like xrefmissing.load_db() from (commit, upstream,
+    # refcommit) tuples, with hex digits standing for the shas
+    columns = {col: [''] * len(rows) for col in xrefmissing.DB_COLUMNS}
+    for i, (commit, upstream, ref) in enumerate(rows):
+        columns['Commit_hexsha'][i] = commit * 40
+        columns['Commit_summary'][i] = commit
+        columns['Commit_upstream_hexsha'][i] = upstream * 40
+        columns['Refcommit_hexsha'][i] = ref * 40
+    return xrefmissing.table_from_columns(columns)
+
+
+def test_xrefmissing_transitive():
+    """
+    Test that xrefmissing.find_missing() with transitive=True follows the
+    chains of fixes of the missing commits, stopping on reference cycles
+    and on fixes already in the left database
+    """
+    # Stable commit '1' backports 'a'. In the right database, 'b' fixes
+    # 'a' and 'd', 'c' fixes 'b', 'd' fixes 'c', and 'f' fixes 'e' which
+    # is fixed by '9' already in the left database
+    left_db = make_db([('1', 'a', ''), ('2', '9', '')])
+    right_db = make_db([
+        ('a', '', ''), ('b', '', 'a'), ('b', '', 'd'), ('c', '', 'b'),
+        ('d', '', 'c'), ('e', '', ''), ('9', '', 'e'), ('f', '', '9')])
+
+    df = xrefmissing.find_missing(left_db, right_db)
+    assert list(df['Missing_commit_summary']) == ['b', 'f']
+    assert 'Depth' not in df
+
+    df = xrefmissing.find_missing(left_db, right_db, transitive=True)
+    assert list(df['Missing_commit_summary']) == ['b', 'f', 'c', 'd']
+    assert list(df['Depth']) == [1, 1, 2, 3]
+    assert list(df['Based_on_commit_upstream'].str.slice(0, 1)) == \
+        ['a', '9', 'b', 'c']
+
+
+def test_xrefmissing_streaming_upstream(tmp_path):
+    """
+    Test that xrefmissing.find_missing_streaming() falls back to the local
+    sha only for the right rows that have no upstream sha
+    """
+    # Stable commits '1' and '2' backport 'a' and 'd'. The right database
+    # has 'd' as a local commit of upstream 'e' that fixes 'a': 'e' is
+    # missing, although its local sha 'd' is an upstream sha in the left
+    left_db = make_db([('1', 'a', ''), ('2', 'd', '')])
+    right_db = make_db([('d', 'e', 'a')])
+    right = tmp_path / "right.csv"
+    right_db.to_frame().to_csv(right, index=False)
+
+    df = xrefmissing.find_missing(left_db, right_db)
+    assert list(df['Missing_commit_upstream']) == ['e' * 40]
+    assert df.equals(xrefmissing.find_missing_streaming(left_db, right))
+
+
+def test_xrefquery(set_up_test_data):
+    """
+    Test that xrefquery.py finds the same missing commits from the branches
+    in a SQLite database as xrefmissing.py finds from csv databases
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    db = TEST_DATA_DIR / "xref.sqlite"
+    for branch, rev in [("left", "v4.19^..v4.19.7"),
+                        ("right", "v4.19^..v4.19.10")]:
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", db,
+               "--branch", branch,
+               rev]
+        assert subprocess.run(cmd).returncode == 0
+        assert subprocess.run(cmd).returncode == 0
+
+        outfile = TEST_DATA_DIR / ("%s.csv" % branch)
+        cmd = [XREFDB,
+               "--git-dir", gitdir,
+               "--out", outfile,
+               rev]
+        assert subprocess.run(cmd).returncode == 0
+
+    outfile = TEST_DATA_DIR / "missing_sqlite.csv"
+    cmd = [XREFQUERY, db, "missing", "left", "right", "--out", outfile]
+    assert subprocess.run(cmd).returncode == 0
+    expected = TEST_DATA_DIR / "missing_csv.csv"
+    cmd = [XREFMISSING,
+           TEST_DATA_DIR / "left.csv",
+           TEST_DATA_DIR / "right.csv",
+           "--out", expected]
+    assert subprocess.run(cmd).returncode == 0
+    assert open(outfile).read() == open(expected).read()
+
+    # Building a branch again replaces its earlier rows
+    cmd = [XREFQUERY, db, "branches"]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8').stdout
+    assert re.search(r'^left\s.*\s%d$' % (
+        sum(1 for line in open(TEST_DATA_DIR / "left.csv")) - 1), out, re.M)
+
+    cmd = [XREFQUERY, db, "fixes", "--branch", "right", "c4cfcf6f4297"]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8').stdout
+    assert "8535e9548e83b06bd8b5766376d6b5d6aed4dc04" in out
+
+    # Other files are rejected without modifying them
+    empty = TEST_DATA_DIR / "empty.sqlite"
+    empty.touch()
+    for other in [TEST_DATA_DIR / "left.csv", empty]:
+        cmd = [XREFQUERY, other, "branches"]
+        ret = subprocess.run(cmd, stderr=subprocess.PIPE, encoding='utf-8')
+        assert ret.returncode == 1
+        assert ret.stderr.startswith("Error: ")
+    assert empty.stat().st_size == 0
+
+
+def test_xrefmissing_sqlite(set_up_test_data):
+    """
+    Test that xrefmissing.py compares SQLite databases holding a single
+    branch, and points to xrefquery.py for databases with several branches
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    left = TEST_DATA_DIR / "left.csv"
+    right = TEST_DATA_DIR / "right.sqlite"
+    both = TEST_DATA_DIR / "both.sqlite"
+    for outfile, rev in [(left, "v4.19^..v4.19.7"),
+                         (right, "v4.19^..v4.19.10"),
+                         (both, "v4.19^..v4.19.7"),
+                         (both, "v4.19^..v4.19.10")]:
+        cmd = [XREFDB, "--git-dir", gitdir, "--out", outfile, rev]
+        assert subprocess.run(cmd).returncode == 0
+
+    expected = TEST_DATA_DIR / "missing_csv.csv"
+    cmd = [XREFDB, "--git-dir", gitdir, "--out", TEST_DATA_DIR / "right.csv",
+           "v4.19^..v4.19.10"]
+    assert subprocess.run(cmd).returncode == 0
+    cmd = [XREFMISSING, left, TEST_DATA_DIR / "right.csv", "--out", expected]
+    assert subprocess.run(cmd).returncode == 0
+    for args in [[], ["--streaming"]]:
+        outfile = TEST_DATA_DIR / "missing_sqlite.csv"
+        cmd = [XREFMISSING, left, right, "--out", outfile] + args
+        print(cmd)
+        assert subprocess.run(cmd).returncode == 0
+        assert open(outfile).read() == open(expected).read()
+
+    cmd = [XREFMISSING, left, both]
+    ret = subprocess.run(cmd, stderr=subprocess.PIPE, encoding='utf-8')
+    assert ret.returncode == 1
+    assert "xrefquery.py" in ret.stderr
+
+    # Loading a branch by name
+    df = xrefmissing.load_db(both, "v4.19^..v4.19.10").to_frame()
+    assert df.equals(xrefmissing.load_db(right).to_frame())
+
+
+def test_stats(set_up_test_data):
+    """
+    Test that xrefdb.py and xrefmissing.py report the stats of their phases
+    and write profiling data
+    """
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outfile = TEST_DATA_DIR / "xrefdb_out.csv"
+    statsfile = TEST_DATA_DIR / "stats.json"
+    profile = TEST_DATA_DIR / "xrefdb.prof"
+    cmd = [XREFDB,
+           "--git-dir", gitdir,
+           "--out", outfile,
+           "--stats",
+           "--stats-json", statsfile,
+           "--profile", profile,
+           "v4.19^..v4.19.1"]
+    ret = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8')
+    assert ret.returncode == 0
+    assert "Peak RSS" in ret.stdout
+    assert profile.exists()
+    with open(statsfile) as f:
+        stats = json.load(f)
+    phases = {phase['name']: phase for phase in stats['phases']}
+    for name in ['list commits', 'parse commits', 'upstream index',
+                 'reference walk', 'write csv']:
+        assert name in phases
+    rows = sum(1 for line in open(outfile)) - 1
+    assert phases['reference walk']['counts']['rows'] == rows
+    assert phases['parse commits']['per_second']['commits'] > 0
+
+    cmd = [XREFMISSING,
+           outfile,
+           outfile,
+           "--out", TEST_DATA_DIR / "missing.csv",
+           "--stats-json", statsfile]
+    assert subprocess.run(cmd).returncode == 0
+    with open(statsfile) as f:
+        stats = json.load(f)
+    phases = {phase['name']: phase for phase in stats['phases']}
+    assert phases['load csv']['calls'] == 2
+    assert phases['load csv']['counts']['rows'] == 2 * rows
+    assert phases['join upstream']['counts']['missing'] == 0
+
+
 def test_xrefmissing_none(set_up_test_data):
     """
     Test that xrefmissing.py runs and generates the expected output when
@@ -163,31 +661,14 @@ def test_xrefmissing_none(set_up_test_data):
     assert not Path(outfile).is_file()
 
 
-def test_find_missing_commits_basic(set_up_test_data):
+def make_findmissing(checklist):
     """
-    Test that find-missing-commits.py runs and generates the expected output
-    with a blacklist file
+    Copy find-missing-commits.py to the test data directory, replacing
+    its CHECKLIST with 'checklist'
     """
-
-    # We need to edit the CHECKLIST for this test instance
     findmissing_temp = TEST_DATA_DIR / "find-missing-commits.py"
     cmd = ["cp", FINDMISSING, findmissing_temp]
     assert subprocess.run(cmd).returncode == 0
-    checklist = '''
-CHECKLIST = \\
-    [
-        {
-            'stable_rev': 'v4.19^..v4.19.7',
-            'stable_out': 'v4.19.7.csv',
-            'other_rev': 'v4.19^..v4.19.10',
-            'other_out': 'v4.19.10.csv',
-            'missing_out': 'missingfixes.csv',
-            'blacklist': '%s',
-        },
-    ]
-    '''
-    blacklist = TEST_DATA_DIR / "blacklist_v4.19.txt"
-    checklist = checklist % blacklist
     text = None
     with open(findmissing_temp, 'r') as f:
         text = f.read()
@@ -213,6 +694,32 @@ CHECKLIST = \\
     assert text is not None
     with open(findmissing_temp, 'w') as f:
         f.write(text)
+    return findmissing_temp
+
+
+def test_find_missing_commits_basic(set_up_test_data):
+    """
+    Test that find-missing-commits.py runs and generates the expected output
+    with a blacklist file
+    """
+
+    # We need to edit the CHECKLIST for this test instance
+    checklist = '''
+CHECKLIST = \\
+    [
+        {
+            'stable_rev': 'v4.19^..v4.19.7',
+            'stable_out': 'v4.19.7.csv',
+            'other_rev': 'v4.19^..v4.19.10',
+            'other_out': 'v4.19.10.csv',
+            'missing_out': 'missingfixes.csv',
+            'blacklist': '%s',
+        },
+    ]
+    '''
+    blacklist = TEST_DATA_DIR / "blacklist_v4.19.txt"
+    checklist = checklist % blacklist
+    findmissing_temp = make_findmissing(checklist)
 
     # Run it
     gitdir = TEST_DATA_DIR / "v4.19.10"
@@ -230,5 +737,118 @@ CHECKLIST = \\
     assert(lines - 1 == 2)
 
 
+def test_find_missing_commits_jobs(set_up_test_data):
+    """
+    Test that find-missing-commits.py --jobs runs the CHECKLIST items
+    concurrently, building the databases shared by the items once
+    """
+    checklist = '''
+CHECKLIST = \\
+    [
+        {
+            'stable_rev': 'v4.19^..v4.19.7',
+            'stable_out': 'v4.19.7.csv',
+            'other_rev': 'v4.19^..v4.19.10',
+            'other_out': 'v4.19.10.csv',
+            'missing_out': 'missing_v4.19.7.csv',
+            'blacklist': '',
+        },
+        {
+            'stable_rev': 'v4.19^..v4.19.6',
+            'stable_out': 'v4.19.6.csv',
+            'other_rev': 'v4.19^..v4.19.10',
+            'other_out': 'v4.19.10.csv',
+            'missing_out': 'missing_v4.19.6.csv',
+            'blacklist': '',
+        },
+        {
+            'stable_rev': 'v4.19^..v4.19.10',
+            'stable_out': 'v4.19.10.csv',
+            'other_rev': 'v4.19^..v4.19.10',
+            'other_out': 'v4.19.10.csv',
+            'missing_out': 'missing_v4.19.10.csv',
+            'blacklist': '',
+        },
+    ]
+    '''
+    findmissing_temp = make_findmissing(checklist)
+
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outdir = TEST_DATA_DIR / "missing"
+    cmd = [findmissing_temp,
+           "--stable", gitdir,
+           "--other", gitdir,
+           "--dst", outdir,
+           "--jobs", "3"]
+    ret = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8')
+    assert ret.returncode == 0
+    # The results are printed in CHECKLIST order
+    order = [ret.stdout.find("%s.csv is missing" % name)
+             for name in ["v4.19.7", "v4.19.6", "v4.19.10"]]
+    assert -1 not in order and order == sorted(order)
+    lines = sum(1 for line in open(outdir / "missing_v4.19.7.csv"))
+    assert lines - 1 == 3
+    assert (outdir / "missing_v4.19.6.csv").exists()
+    assert not (outdir / "missing_v4.19.10.csv").exists()
+
+    cmd = [findmissing_temp, "--stable", gitdir, "--other", gitdir,
+           "--dst", outdir, "--jobs", "0"]
+    assert subprocess.run(cmd).returncode == 2
+
+
+def test_find_missing_commits_cache(set_up_test_data):
+    """
+    Test that find-missing-commits.py --cache-dir reuses the databases
+    built on earlier runs, as long as the revision ranges are unchanged
+    """
+    checklist = '''
+CHECKLIST = \\
+    [
+        {
+            'stable_rev': 'v4.19^..v4.19.7',
+            'stable_out': 'v4.19.7.csv',
+            'other_rev': '%s',
+            'other_out': 'v4.19.10.csv',
+            'missing_out': 'missingfixes.csv',
+            'blacklist': '',
+        },
+    ]
+    '''
+    gitdir = TEST_DATA_DIR / "v4.19.10"
+    outdir = TEST_DATA_DIR / "missing"
+    cachedir = TEST_DATA_DIR / "cache"
+    cmd = ["--stable", gitdir,
+           "--other", gitdir,
+           "--dst", outdir,
+           "--cache-dir", cachedir]
+
+    findmissing_temp = make_findmissing(checklist % "v4.19^..v4.19.10")
+    outputs = []
+    for _ in range(2):
+        shutil.rmtree(outdir, ignore_errors=True)
+        assert subprocess.run([findmissing_temp] + cmd).returncode == 0
+        outputs.append(open(outdir / "missingfixes.csv").read())
+    assert outputs[0] == outputs[1]
+    assert len(list(cachedir.glob("*.csv"))) == 2
+
+    # The cached build is reused: edit it to see that it gets used
+    cached = [f for f in cachedir.glob("*.csv")
+              if open(f).read() == open(outdir / "v4.19.10.csv").read()]
+    assert len(cached) == 1
+    with open(cached[0]) as f:
+        lines = f.readlines()
+    with open(cached[0], 'w') as f:
+        f.writelines(lines[:1])
+    shutil.rmtree(outdir)
+    assert subprocess.run([findmissing_temp] + cmd).returncode == 0
+    assert not (outdir / "missingfixes.csv").exists()
+
+    # Only the database whose revision range changed is built again
+    findmissing_temp = make_findmissing(checklist % "v4.19^..v4.19.9")
+    shutil.rmtree(outdir)
+    assert subprocess.run([findmissing_temp] + cmd).returncode == 0
+    assert len(list(cachedir.glob("*.csv"))) == 3
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
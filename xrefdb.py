@@ -4,79 +4,412 @@
 # SPDX-License-Identifier: GPL-2.0-only
 
 import re
-import git
 import csv
 import argparse
 import os
 import sys
-import pandas as pd
+import json
+import subprocess
+import sqlite3
+import multiprocessing
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+
+import xrefutil
+from xrefutil import LazyModule, STATS
+from xrefformat import (
+    db_format, read_npz, write_npz, read_sqlite, write_sqlite,
+    read_sqlite_meta, write_sqlite_meta)
+
+git = LazyModule('git')
 
 ################################################################################
 
+# Details of a commit in the revision range, as read from the commit object.
+# The referenced and upstream commit shas are stored as they appear in the
+# commit message, that is, possibly abbreviated.
+CommitInfo = namedtuple(
+    'CommitInfo',
+    ['hexsha', 'summary', 'committed_datetime', 'refshas', 'upstreamsha'])
+
+# Columns of the output, in alphabetical order
+COLUMNS = [
+    'Commit_datetime',
+    'Commit_hexsha',
+    'Commit_summary',
+    'Commit_upstream_hexsha',
+    'Refcommit_datetime',
+    'Refcommit_hexsha',
+    'Refcommit_upstream_hexsha',
+]
+
+# Output row for a pair of [referenced_commit, commit]
+XrefRow = namedtuple('XrefRow', COLUMNS)
+
+# Abbreviated shas at least this long are resolved from the ShaPrefixIndex
+# without asking git, if they match exactly one commit in the revision range.
+# Shorter abbreviations might be ambiguous with some object outside the
+# range, so those are always resolved with git. Kernel commit references are
+# expected to use at least 12 characters.
+PREFIX_INDEX_MIN_LEN = 12
+
+# Ways to read the commits: through GitPython Commit objects, or by parsing
+# the output of 'git log'
+BACKENDS = ['gitpython', 'gitlog']
+
+# Patterns for the commit references in commit messages, see
+# match_referenced_sha() and match_upstream_sha()
+RE_REVERT_SHA = re.compile(
+    r'.*[Rr]evert.{0,10}commit.*\s+(?P<sha>[0-9a-f]{5,40})\b')
+RE_FIXES_SHA = re.compile(
+    r'.*[Ff]ixes.{0,10}\s+(?P<sha>[0-9a-f]{5,40})\b')
+RE_UPSTREAM_1 = re.compile(
+    # Negative lookbehind:
+    # Match (1) that is not preceded by (2), (3), (4), or (5)
+    # We need this because below is a valid upstream reference:
+    #     commit HEXSHA1 upstream.
+    # Whereas, this is not a valid upstream reference:
+    #     This reverts commit HEXSHA2 which is
+    #     commit HEXSHA1 upstream.
+    r'(?<!reverts commit [0-9a-f]{40} which is)'    # (2)
+    r'(?<!reverts commit [0-9a-f]{40}, which is)'   # (3)
+    r'(?<!reverts commit [0-9a-f]{40} which was)'   # (4)
+    r'(?<!reverts commit [0-9a-f]{40}, which was)'  # (5)
+    r'$'
+    # (1)
+    r'\s*\[?\s*[Cc]omm?[it]{2}\s*(?P<sha>[0-9a-f]{10,40})\s+[Uu]pst?ream\.?\s*\]?\s*$',
+    re.MULTILINE)
+RE_UPSTREAM_2 = re.compile(
+    r'(?<!reverts commit [0-9a-f]{40} which is)'    # (2)
+    r'(?<!reverts commit [0-9a-f]{40}, which is)'   # (3)
+    r'(?<!reverts commit [0-9a-f]{40} which was)'   # (4)
+    r'(?<!reverts commit [0-9a-f]{40}, which was)'  # (5)
+    r'$'
+    # (1)
+    r'^\s*\[?\s*[Uu]pst?ream\s+[Cc]omm?[it]{2}\s*(?P<sha>[0-9a-f]{40})',
+    re.MULTILINE)
+
+
+class ShaPrefixIndex:
+
+    def __init__(self, hexshas):
+        # Sorted 20-byte binary shas, concatenated into one bytes object
+        # instead of one object per sha. bisect_left() searches it through
+        # __len__() and __getitem__().
+        self.binshas = b''.join(sorted(bytes.fromhex(sha) for sha in hexshas))
+
+    def __len__(self):
+        return len(self.binshas) // 20
+
+    def __getitem__(self, i):
+        return self.binshas[i * 20:(i + 1) * 20]
+
+    def find(self, prefix, limit=2):
+        # Return at most 'limit' full shas that start with 'prefix'
+        matches = []
+        # Smallest binary sha that could start with an odd-length prefix
+        lowest = bytes.fromhex(prefix + '0' * (len(prefix) % 2))
+        i = bisect_left(self, lowest)
+        while i < len(self) and len(matches) < limit:
+            hexsha = self[i].hex()
+            if not hexsha.startswith(prefix):
+                break
+            matches.append(hexsha)
+            i += 1
+        return matches
+
+
+class SharedCommits:
+    # Commits parsed for one XrefDb, reused by the other XrefDb objects
+    # built from the same repository: when building the databases of
+    # several overlapping revision ranges, each commit is read and parsed
+    # only once. Unlike the CommitCache, this is kept in memory only.
+
+    def __init__(self):
+        # Key: commit sha, Value: CommitInfo
+        self.commits = {}
+        # Abbreviated shas resolved with git, which do not depend on the
+        # revision range unlike those resolved from the ShaPrefixIndex
+        # Key: abbreviated sha, Value: full sha or None
+        self.shorttolong = {}
+
+
+class CommitCache:
+
+    # Bump the version whenever the parsing of commit messages changes, so
+    # that the commits cached by earlier versions are parsed again
+    FILENAME = "xrefdb-commits-v1.sqlite"
+
+    def __init__(self, cachedir):
+        # Persistent cache of the CommitInfo details of each commit.
+        # Commits are immutable, so the cached details never go stale.
+        os.makedirs(cachedir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cachedir, self.FILENAME))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS commits ("
+            "sha BLOB PRIMARY KEY, summary TEXT, "
+            "committed_date INTEGER, committer_tz_offset INTEGER, "
+            "refshas TEXT, upstreamsha TEXT)")
+        # Rows not yet written to the cache
+        self.pending = []
+
+    def get(self, hexsha):
+        row = self.db.execute(
+            "SELECT summary, committed_date, committer_tz_offset, "
+            "refshas, upstreamsha FROM commits WHERE sha = ?",
+            (bytes.fromhex(hexsha),)).fetchone()
+        if not row:
+            return None
+        summary, date, tzoffset, refshas, upstreamsha = row
+        return CommitInfo(
+            hexsha=hexsha,
+            summary=summary,
+            committed_datetime=commit_datetime(date, tzoffset),
+            refshas=tuple(refshas.split()),
+            upstreamsha=upstreamsha)
+
+    def put(self, commit):
+        dt = commit.committed_datetime
+        self.pending.append((
+            bytes.fromhex(commit.hexsha),
+            commit.summary,
+            int(dt.timestamp()),
+            -int(dt.utcoffset().total_seconds()),
+            " ".join(commit.refshas),
+            commit.upstreamsha))
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?)",
+                self.pending)
+        self.pending = []
+
 
 class XrefDb:
 
-    def __init__(self, gitdir, rev):
+    def __init__(self, gitdir, rev, cachedir=None, since=None, jobs=1,
+                 backend='gitpython', repo=None, shared=None):
         self.gitdir = gitdir
         # Stats are generated based on the git commit entries in the
         # specified git repository in the given revision range
         self.rev = rev
-        # Dictionary to store the csv data
-        # Key: column header, Value: list of entries
-        self.entries = {}
-        # GitPython Repo object
-        self.repo = git.Repo(self.gitdir)
+        # Earlier tip commit of the revision range: if set, only the
+        # commits added to the range on top of it are included
+        self.since = since
+        # GitPython Repo object, can be shared by several XrefDb objects
+        self.repo = repo if repo is not None else git.Repo(self.gitdir)
+        # Commit shas the revision range resolved to when it was read
+        self.revshas = resolve_rev(self.repo, self.rev)
+        # Commits in the revision range in chronological order, with the
+        # details find_references() needs parsed from each commit message
+        self.commits = []
+        # Key: commit sha, Value: CommitInfo of a commit in the range
+        self.mapshatocommit = {}
+        # ShaPrefixIndex of the commits in the range
+        self.shaindex = None
+        # Optional CommitCache to skip reading commits seen on earlier runs
+        self.cache = CommitCache(cachedir) if cachedir else None
+        # Optional SharedCommits of XrefDb objects built from the same
+        # repository, so that commits in several ranges are parsed once
+        self.shared = shared
+        # Number of worker processes that read and parse the commits
+        self.jobs = jobs
+        # How the commits are read, one of BACKENDS
+        self.backend = backend
         # Map a stable commit to an upstream commit
         # Key: stable commit sha, Value: upstream commit sha
         self.mapcommittoupstream = {}
-        self._build_upstreamindex()
+        # Map an abbreviated commit sha to the full commit sha
+        # Key: abbreviated sha, Value: full sha or None if sha is unknown
+        # or ambiguous
+        self.mapshorttolong = {}
+        self._read_commits()
 
     def find_references(self):
-        for commit in list(self.repo.iter_commits(self.rev, reverse=True)):
-            self._find_references(commit)
+        # Generate the output rows, one XrefRow for each pair of
+        # [referenced_commit, commit]. The rows are written as they are
+        # generated, so the time spent here is summed separately from the
+        # time spent writing them.
+        seconds = 0.0
+        rows = 0
+        try:
+            for commit in self.commits:
+                start = time.perf_counter()
+                refs = list(self._find_references(commit))
+                seconds += time.perf_counter() - start
+                rows += len(refs)
+                yield from refs
+        finally:
+            STATS.add('reference walk', seconds,
+                      commits=len(self.commits), rows=rows)
+
+    def write(self, filename, append=False, branch=None, rows=None):
+        # Write the output in the format given by the file name extension,
+        # see xrefformat.FORMATS. SQLite databases hold several outputs,
+        # each tagged by 'branch', which defaults to the revision range.
+        # 'rows' are the XrefRow values to write, if already generated with
+        # find_references().
+        fmt = db_format(filename)
+        with STATS.phase('write %s' % fmt):
+            if fmt == 'npz':
+                self.to_npz(filename, append, rows)
+            elif fmt == 'sqlite':
+                self.to_sqlite(filename, append, branch, rows)
+            else:
+                self.to_csv(filename, append, rows)
+
+    def to_npz(self, filename, append=False, rows=None):
+        write_npz(filename, self._rows(rows), append)
+
+    def to_sqlite(self, filename, append=False, branch=None, rows=None):
+        write_sqlite(
+            filename, self._rows(rows), branch or self.rev, append)
+
+    def to_csv(self, filename, append=False, rows=None):
+        # Write the rows to file as they are generated, so that the memory
+        # use does not grow with the size of the revision range
+        with open(filename, 'a' if append else 'w',
+                  newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+            if not append:
+                writer.writerow(COLUMNS)
+            writer.writerows(self._rows(rows))
+
+    def _rows(self, rows):
+        return self.find_references() if rows is None else rows
+
+    def write_meta(self, filename, branch=None):
+        # Record the revision range that output 'filename' was built from,
+        # see update_base()
+        revmeta = dict(self.revshas, rev=self.rev)
+        if db_format(filename) == 'sqlite':
+            write_sqlite_meta(filename, branch or self.rev, revmeta)
+            return
+        with open(meta_filename(filename), 'w') as f:
+            json.dump(revmeta, f, indent=4)
+
+    def read_upstreamindex(self, filename, branch=None):
+        # Read the upstream references of the commits in an earlier output
+        # 'filename', so that the commits added on top of it get the
+        # Refcommit_upstream_hexsha of the earlier commits they reference
+        fmt = db_format(filename)
+        if fmt == 'sqlite':
+            self._add_upstreamindex(read_sqlite(
+                filename, branch or self.rev,
+                ['Commit_hexsha', 'Commit_upstream_hexsha']))
+        elif fmt == 'npz':
+            columns = read_npz(filename)
+            shas = zip(columns['Commit_hexsha'].tolist(),
+                       columns['Commit_upstream_hexsha'].tolist())
+            self._add_upstreamindex(shas)
+        else:
+            with open(filename, newline='', encoding='utf-8') as f:
+                self._add_upstreamindex(
+                    (row['Commit_hexsha'], row['Commit_upstream_hexsha'])
+                    for row in csv.DictReader(f))
 
-    def to_csv(self, filename):
-        df = pd.DataFrame(self.entries)
-        # Sort columns alphabetically
-        df = df.sort_index(axis=1)
-        df.to_csv(path_or_buf=filename, quoting=csv.QUOTE_ALL,
-                  sep=",", index=False, encoding='utf-8')
+    def _add_upstreamindex(self, shas):
+        for sha, upstreamsha in shas:
+            if upstreamsha:
+                self.mapcommittoupstream.setdefault(sha, upstreamsha)
 
     def _get_long_commit_sha(self, sha):
         if not sha:
             return None
         if len(sha) >= 40:
             return sha
-        try:
-            return self.repo.git.rev_parse(sha)
-        except git.GitCommandError:
-            return None
+        if sha not in self.mapshorttolong:
+            self._resolve_short_shas([sha])
+        return self.mapshorttolong[sha]
+
+    def _resolve_short_shas(self, shas):
+        shas = sorted(set(
+            sha for sha in shas
+            if sha and len(sha) < 40 and sha not in self.mapshorttolong))
+        # Most referenced commits are in the revision range: try resolving
+        # the abbreviated shas from the prefix index first
+        if self.shaindex:
+            unresolved = []
+            for sha in shas:
+                matches = self.shaindex.find(sha)
+                if len(matches) > 1:
+                    # Ambiguous already in the revision range
+                    self.mapshorttolong[sha] = None
+                elif matches and len(sha) >= PREFIX_INDEX_MIN_LEN:
+                    self.mapshorttolong[sha] = matches[0]
+                else:
+                    unresolved.append(sha)
+            shas = unresolved
+        if self.shared:
+            # Resolved with git for an earlier revision range
+            unresolved = []
+            for sha in shas:
+                if sha in self.shared.shorttolong:
+                    self.mapshorttolong[sha] = self.shared.shorttolong[sha]
+                else:
+                    unresolved.append(sha)
+            shas = unresolved
+        if not shas:
+            return
+        with STATS.phase('sha resolution', shas=len(shas)):
+            self._resolve_short_shas_git(shas)
+        if self.shared:
+            for sha in shas:
+                self.shared.shorttolong[sha] = self.mapshorttolong[sha]
+
+    def _resolve_short_shas_git(self, shas):
+        # Resolve the rest with one 'git cat-file --batch-check' process,
+        # instead of running 'git rev-parse' separately for each sha
+        cmd = ['git', '--git-dir', self.repo.git_dir,
+               'cat-file', '--batch-check=%(objectname)']
+        pipe = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, encoding='utf-8')
+        stdout, stderr = pipe.communicate(
+            "".join("%s\n" % sha for sha in shas))
+        if pipe.returncode != 0:
+            raise ValueError(stderr)
+        # cat-file outputs one line per input sha: the full sha if the
+        # object was found, or "SHA missing" or "SHA ambiguous" otherwise
+        for sha, line in zip(shas, stdout.splitlines()):
+            fields = line.split()
+            self.mapshorttolong[sha] = fields[0] if len(fields) == 1 else None
 
     def _get_commit(self, commitsha):
         if not commitsha:
             return None
+        if commitsha in self.mapshatocommit:
+            return self.mapshatocommit[commitsha]
         try:
             return self.repo.commit(commitsha)
         except ValueError:
             return None
 
     def _find_references(self, commit):
-        refset = set()
+        # Referenced commit shas in the order they appear in the commit
+        # message, so that the output does not depend on set ordering
+        refs = []
 
         # Find referenced commit shas ("Fixes:" and "Revert" tags)
-        for line in commit.message.splitlines():
-            refsha = self._match_referenced_sha(line)
-            if refsha:
-                refset.add(refsha)
+        for refsha in commit.refshas:
+            refsha = self._get_long_commit_sha(refsha)
+            if refsha and refsha not in refs:
+                refs.append(refsha)
 
         # If no referenced commits were found, we still want to output
         # ("stamp") the commit; therefore, add an "empty" reference
-        if not refset:
-            refset.add("")
+        if not refs:
+            refs.append("")
 
         # Output all found pairs of [referenced_commit, commit]
-        for refsha in refset:
-            self._stamp_commit(refsha, commit)
+        for refsha in refs:
+            row = self._stamp_commit(refsha, commit)
+            if row:
+                yield row
 
     def _stamp_commit(self, refsha, commit):
         ref_commit = self._get_commit(refsha)
@@ -87,7 +420,7 @@ class XrefDb:
             if ref_commit.hexsha == commit.hexsha:
                 print("[+] Warning: ignored commit where referenced commit "
                       "and fix are the same (%s)" % (commit.hexsha))
-                return
+                return None
             ref_sha = ref_commit.hexsha
             ref_datetime = ref_commit.committed_datetime
 
@@ -95,75 +428,330 @@ class XrefDb:
             commit.hexsha, "")
         ref_upstream_hexsha = self.mapcommittoupstream.get(ref_sha, "")
 
-        setcol = self.entries.setdefault
-        setcol('Commit_hexsha', []).append(commit.hexsha)
-        setcol('Commit_summary', []).append(commit.summary)
-        setcol('Commit_datetime', []).append(commit.committed_datetime)
-        setcol('Commit_upstream_hexsha', []).append(commit_upstream_hexsha)
-        setcol('Refcommit_hexsha', []).append(ref_sha)
-        setcol('Refcommit_datetime', []).append(ref_datetime)
-        setcol('Refcommit_upstream_hexsha', []).append(ref_upstream_hexsha)
-
-    def _match_referenced_sha(self, line):
-        RE_REVERT_SHA = re.compile(
-            r'.*[Rr]evert.{0,10}commit.*\s+(?P<sha>[0-9a-f]{5,40})\b')
-        RE_FIXES_SHA = re.compile(
-            r'.*[Ff]ixes.{0,10}\s+(?P<sha>[0-9a-f]{5,40})\b')
-        refsha = ""
-        match = ""
-        if not match:
-            # (1) Try matching lines like: "This reverts commit SHA_HERE"
-            match = RE_REVERT_SHA.match(line)
-        if not match:
-            # (2) Try matching lines like: "Fixes: SHA_HERE"
-            match = RE_FIXES_SHA.match(line)
-        if match:
-            refsha = match.group('sha')
-            refsha = self._get_long_commit_sha(refsha)
-        return refsha
+        return XrefRow(
+            Commit_datetime=commit.committed_datetime,
+            Commit_hexsha=commit.hexsha,
+            Commit_summary=commit.summary,
+            Commit_upstream_hexsha=commit_upstream_hexsha,
+            Refcommit_datetime=ref_datetime,
+            Refcommit_hexsha=ref_sha,
+            Refcommit_upstream_hexsha=ref_upstream_hexsha)
+
+    def _read_commits(self):
+        # Walk the revision range once, reading each commit message only
+        # once: the upstream index and the referenced commit shas are both
+        # parsed from the same message. iter_commits() does not read
+        # the commit objects, so cached commits are not read at all.
+        revs = self.rev
+        if self.since:
+            revs = [self.rev, "^%s" % self.since]
+        commits = []
+        with STATS.phase('list commits') as counts:
+            for commit in self.repo.iter_commits(revs):
+                info = None
+                if self.shared:
+                    info = self.shared.commits.get(commit.hexsha)
+                if not info and self.cache:
+                    info = self.cache.get(commit.hexsha)
+                commits.append(info if info else commit)
+            counts['commits'] = len(commits)
+            unparsed = sum(
+                1 for c in commits if not isinstance(c, CommitInfo))
+            counts['cache_hits'] = len(commits) - unparsed
+
+        with STATS.phase('parse commits') as counts:
+            self._parse_commits(commits)
+            counts['commits'] = len(self.commits)
+            counts['parsed'] = unparsed
+
+        with STATS.phase('upstream index') as counts:
+            self._build_upstreamindex()
+            counts['upstream_refs'] = len(self.mapcommittoupstream)
+
+    def _parse_commits(self, commits):
+        unparsed = [c.hexsha for c in commits
+                    if not isinstance(c, CommitInfo)]
+        if self.jobs > 1 and len(unparsed) > 1:
+            # Parse the commits in chunks in worker processes. imap()
+            # returns the results in the original order, so the output
+            # is the same as when parsing the commits serially.
+            chunksize = max(1, len(unparsed) // (self.jobs * 4))
+            chunks = [unparsed[i:i + chunksize]
+                      for i in range(0, len(unparsed), chunksize)]
+            initargs = (self.repo.git_dir, self.backend)
+            # Forking is only safe while this process runs a single
+            # thread. find-missing-commits.py builds the databases in
+            # threads, and a forked worker could inherit locks held by the
+            # other threads, such as those of the git processes or STATS.
+            # Start the workers as new interpreters then.
+            context = multiprocessing.get_context(
+                'spawn' if threading.active_count() > 1 else None)
+            with context.Pool(self.jobs, _init_worker, initargs) as pool:
+                parsed = [commit
+                          for chunk in pool.imap(_read_commits_worker, chunks)
+                          for commit in chunk]
+        else:
+            parsed = read_commits(self.repo, unparsed, self.backend)
+
+        parsed = iter(parsed)
+        for commit in commits:
+            if not isinstance(commit, CommitInfo):
+                commit = next(parsed)
+                if self.cache:
+                    self.cache.put(commit)
+            if self.shared:
+                self.shared.commits[commit.hexsha] = commit
+            self.commits.append(commit)
+        if self.cache:
+            self.cache.flush()
 
     def _build_upstreamindex(self):
-        RE_UPSTREAM_1 = re.compile(
-            # Negative lookbehind:
-            # Match (1) that is not preceded by (2), (3), (4), or (5)
-            # We need this because below is a valid upstream reference:
-            #     commit HEXSHA1 upstream.
-            # Whereas, this is not a valid upstream reference:
-            #     This reverts commit HEXSHA2 which is
-            #     commit HEXSHA1 upstream.
-            r'(?<!reverts commit [0-9a-f]{40} which is)'    # (2)
-            r'(?<!reverts commit [0-9a-f]{40}, which is)'   # (3)
-            r'(?<!reverts commit [0-9a-f]{40} which was)'   # (4)
-            r'(?<!reverts commit [0-9a-f]{40}, which was)'  # (5)
-            r'$'
-            # (1)
-            r'\s*\[?\s*[Cc]omm?[it]{2}\s*(?P<sha>[0-9a-f]{10,40})\s+[Uu]pst?ream\.?\s*\]?\s*$',
-            re.MULTILINE)
-        RE_UPSTREAM_2 = re.compile(
-            r'(?<!reverts commit [0-9a-f]{40} which is)'    # (2)
-            r'(?<!reverts commit [0-9a-f]{40}, which is)'   # (3)
-            r'(?<!reverts commit [0-9a-f]{40} which was)'   # (4)
-            r'(?<!reverts commit [0-9a-f]{40}, which was)'  # (5)
-            r'$'
-            # (1)
-            r'^\s*\[?\s*[Uu]pst?ream\s+[Cc]omm?[it]{2}\s*(?P<sha>[0-9a-f]{40})',
-            re.MULTILINE)
-        for commit in list(self.repo.iter_commits(self.rev)):
-            match = ""
-            if not match:
-                match = RE_UPSTREAM_1.search(commit.message)
-            if not match:
-                match = RE_UPSTREAM_2.search(commit.message)
-            if match:
-                upstreamsha = match.group('sha')
-                upstreamsha = self._get_long_commit_sha(upstreamsha)
-                if not upstreamsha:
-                    # _get_long_commit_sha() returns None if
-                    # upstreamsha is not in the git tree. We'll ignore
-                    # such upstream references.
-                    continue
-                sha = commit.hexsha
-                self.mapcommittoupstream[sha] = upstreamsha
+        # iter_commits() returns the commits in reverse chronological
+        # order, find_references() outputs them in chronological order
+        self.commits.reverse()
+        self.mapshatocommit = {
+            commit.hexsha: commit for commit in self.commits}
+        self.shaindex = ShaPrefixIndex(self.mapshatocommit)
+
+        # Resolve all abbreviated shas found in the commit messages at once
+        shas = []
+        for commit in self.commits:
+            shas.extend(commit.refshas)
+            shas.append(commit.upstreamsha)
+        self._resolve_short_shas(shas)
+
+        for commit in self.commits:
+            if not commit.upstreamsha:
+                continue
+            upstreamsha = self._get_long_commit_sha(commit.upstreamsha)
+            if not upstreamsha:
+                # _get_long_commit_sha() returns None if
+                # upstreamsha is not in the git tree. We'll ignore
+                # such upstream references.
+                continue
+            self.mapcommittoupstream[commit.hexsha] = upstreamsha
+
+################################################################################
+
+
+def match_referenced_sha(line):
+    refsha = ""
+    match = None
+    # Most lines match neither pattern: check for the fixed substrings each
+    # pattern requires before running the pattern itself
+    if 'evert' in line:
+        # (1) Try matching lines like: "This reverts commit SHA_HERE"
+        match = RE_REVERT_SHA.match(line)
+    if not match and 'ixes' in line:
+        # (2) Try matching lines like: "Fixes: SHA_HERE"
+        match = RE_FIXES_SHA.match(line)
+    if match:
+        refsha = match.group('sha')
+    return refsha
+
+
+def match_upstream_sha(message):
+    # Both patterns require "upstream" or "upsream" in the message
+    if 'pstream' not in message and 'psream' not in message:
+        return ""
+    match = RE_UPSTREAM_1.search(message)
+    if not match:
+        match = RE_UPSTREAM_2.search(message)
+    if match:
+        return match.group('sha')
+    return ""
+
+
+def parse_commit(commit):
+    # Return the CommitInfo of GitPython Commit object 'commit'
+    return parse_message(
+        commit.hexsha, commit.message,
+        commit_datetime(commit.committed_date, commit.committer_tz_offset))
+
+
+def commit_datetime(timestamp, tzoffset):
+    # Return the commit time like GitPython from_timestamp(), but with one
+    # shared tzinfo object per timezone offset: GitPython creates a new one
+    # for each commit, which takes more memory than the datetime itself
+    tz = _TIMEZONES.get(tzoffset)
+    if tz is None:
+        tz = _TIMEZONES.setdefault(
+            tzoffset, git.objects.util.tzoffset(tzoffset))
+    try:
+        return datetime.fromtimestamp(timestamp, tz)
+    except ValueError:
+        return git.objects.util.from_timestamp(timestamp, tzoffset)
+
+
+# Key: timezone offset in seconds west of UTC, Value: tzinfo object
+_TIMEZONES = {}
+
+
+def parse_message(hexsha, message, committed_datetime):
+    # Return the CommitInfo of commit 'hexsha' with the given message.
+    # Most commits reference no other commit: their refshas is the
+    # empty tuple, of which there is only one.
+    refshas = []
+    if 'evert' in message or 'ixes' in message:
+        for line in message.splitlines():
+            refsha = match_referenced_sha(line)
+            if refsha:
+                refshas.append(refsha)
+    return CommitInfo(
+        hexsha=hexsha,
+        summary=message.split("\n", 1)[0],
+        committed_datetime=committed_datetime,
+        refshas=tuple(refshas),
+        upstreamsha=match_upstream_sha(message))
+
+
+def read_commits(repo, hexshas, backend):
+    # Return the CommitInfo of each commit in 'hexshas', reading the commits
+    # with the given backend
+    if backend == 'gitlog':
+        return list(iter_commits_gitlog(repo.git_dir, hexshas))
+    return [parse_commit(git.Commit(repo, bytes.fromhex(hexsha)))
+            for hexsha in hexshas]
+
+
+def iter_commits_gitlog(gitdir, hexshas):
+    # Read the commits 'hexshas' from one 'git log' output stream instead
+    # of reading each commit through a GitPython Commit object
+    if not hexshas:
+        # 'git log' would default to HEAD
+        return
+    cmd = ['git', '--git-dir', gitdir, 'log', '-z',
+           '--no-walk=unsorted', '--stdin',
+           '--format=%H%x00%ct%x00%ci%x00%B']
+    pipe = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+
+    def write_hexshas():
+        for hexsha in hexshas:
+            pipe.stdin.write(b"%s\n" % hexsha.encode())
+        pipe.stdin.close()
+    writer = threading.Thread(target=write_hexshas)
+    writer.start()
+
+    # Output is a sequence of NUL terminated fields, four for each commit:
+    # sha, commit time, commit time in ISO format, and commit message
+    fields = []
+    remainder = b""
+    for chunk in iter(lambda: pipe.stdout.read(1 << 16), b""):
+        tokens = (remainder + chunk).split(b"\0")
+        remainder = tokens.pop()
+        for token in tokens:
+            fields.append(token)
+            if len(fields) < 4:
+                continue
+            hexsha, date, isodate, message = fields
+            fields = []
+            tzoffset = git.objects.util.utctz_to_altz(
+                isodate.split()[-1].decode())
+            yield parse_message(
+                hexsha.decode(),
+                message.decode('utf-8', 'replace'),
+                commit_datetime(int(date), tzoffset))
+
+    writer.join()
+    stderr = pipe.stderr.read().decode('utf-8', 'replace')
+    if pipe.wait() != 0:
+        raise ValueError(stderr)
+
+
+def _init_worker(gitdir, backend):
+    # Initialize a worker process of the pool XrefDb uses with --jobs:
+    # each worker reads the commits through its own Repo object
+    global _worker_repo, _worker_backend
+    _worker_repo = git.Repo(gitdir)
+    _worker_backend = backend
+
+
+def _read_commits_worker(hexshas):
+    return read_commits(_worker_repo, hexshas, _worker_backend)
+
+
+def resolve_rev(repo, rev):
+    # Return the commit shas included in and excluded from revision range
+    # 'rev', for instance, 'v4.19^..v4.19.1' includes v4.19.1 and excludes
+    # v4.19^
+    revshas = {'include': [], 'exclude': []}
+    for sha in repo.git.rev_parse(rev).split():
+        if sha.startswith('^'):
+            revshas['exclude'].append(sha[1:])
+        else:
+            revshas['include'].append(sha)
+    return revshas
+
+
+def meta_filename(filename):
+    return "%s.meta" % filename
+
+
+def update_base(repo, rev, filename, branch=None):
+    # Return the tip commit that the earlier output 'filename' of revision
+    # range 'rev' was built from, if the output can be updated by reading
+    # only the commits added on top of it. Otherwise, return None.
+    try:
+        header = COLUMNS
+        if db_format(filename) == 'sqlite':
+            if not os.path.isfile(filename):
+                raise OSError("no such file: %s" % filename)
+            revmeta = read_sqlite_meta(filename, branch or rev)
+        else:
+            with open(meta_filename(filename)) as f:
+                revmeta = json.load(f)
+            with open(filename, newline='', encoding='utf-8') as f:
+                if db_format(filename) == 'csv':
+                    header = next(csv.reader(f), [])
+    except (OSError, ValueError):
+        print("[+] No earlier build found for %s, building it from "
+              "scratch" % filename)
+        return None
+    if 'Commit_hexsha' not in header:
+        print("[+] Earlier build of %s has no commits, building it from "
+              "scratch" % filename)
+        return None
+
+    revshas = resolve_rev(repo, rev)
+    if (revmeta.get('rev') != rev or
+            revmeta.get('exclude') != revshas['exclude'] or
+            len(revmeta.get('include', [])) != 1 or
+            len(revshas['include']) != 1):
+        print("[+] Revision range of %s has changed, building it from "
+              "scratch" % filename)
+        return None
+
+    oldtip = revmeta['include'][0]
+    newtip = revshas['include'][0]
+    try:
+        repo.git.merge_base('--is-ancestor', oldtip, newtip)
+    except git.GitCommandError:
+        print("[+] History of %s has been rewritten, building it from "
+              "scratch" % filename)
+        return None
+    return oldtip
+
+
+def parse_targets(revs, outfile):
+    # Return the (rev, outfile) pairs to build from the REV arguments: a
+    # single revision range written to 'outfile', or two or more REV:OUT
+    # pairs. A single REV is never split, as revisions such as 'HEAD:path'
+    # may contain ':' themselves.
+    if len(revs) == 1:
+        return [(revs[0], outfile)]
+    targets = []
+    for target in revs:
+        rev, _, out = target.rpartition(':')
+        if not rev or not out:
+            raise ValueError("expected REV:OUT, got '%s'" % target)
+        targets.append((rev, out))
+    outs = [out for _, out in targets]
+    dups = sorted(set(out for out in outs if outs.count(out) > 1))
+    if dups and any(db_format(out) != 'sqlite' for out in dups):
+        raise ValueError("output file given twice: %s" % dups[0])
+    return targets
 
 ################################################################################
 
@@ -187,15 +775,51 @@ def getargs():
         os.path.basename(__file__)
     parser = argparse.ArgumentParser(description=desc, epilog=epil)
 
-    help = "revision specifier, see git-rev-parse for viable options. "
-    parser.add_argument('REV', nargs=1, help=help)
+    help = "revision specifier, see git-rev-parse for viable options. "\
+           "To build several revision ranges at once, give two or more "\
+           "REV:OUT pairs instead, each range written to its own output "\
+           "file OUT: "\
+           "commits in more than one range are read and parsed only once"
+    parser.add_argument('REV', nargs='+', help=help)
 
     help = "file path to git repository, defaults to current working directory"
     parser.add_argument('--git-dir', nargs='?', help=help, default='./')
 
-    help = "set the output file name, default is 'xrefdb.csv'"
+    help = "set the output file name, default is 'xrefdb.csv'. "\
+           "Output is written in compact binary npz format if the "\
+           "file name ends with '.npz', into an indexed SQLite database "\
+           "if it ends with '.sqlite' or '.db', otherwise in csv format"
     parser.add_argument('--out', nargs='?', help=help, default='xrefdb.csv')
 
+    help = "set the name the output is stored with in a SQLite database, "\
+           "replacing the earlier output stored with the same name. "\
+           "Defaults to REV"
+    parser.add_argument('--branch', nargs='?', help=help)
+
+    help = "cache the details parsed from each commit in directory "\
+           "CACHE_DIR, so that later runs over overlapping revision "\
+           "ranges do not need to read the same commits again"
+    parser.add_argument('--cache-dir', nargs='?', help=help)
+
+    help = "update the earlier output file UPDATE in place, instead of "\
+           "writing --out: only the commits added to the revision range "\
+           "since UPDATE was built are read and appended to it. If the "\
+           "history was rewritten, UPDATE is built again from scratch"
+    parser.add_argument('--update', nargs='?', help=help)
+
+    help = "read and parse the commits in JOBS worker processes, "\
+           "default is 1"
+    parser.add_argument(
+        '--jobs', type=xrefutil.positive_int, help=help, default=1)
+
+    help = "set how the commits are read: through GitPython Commit "\
+           "objects, or by parsing the output of a single 'git log' "\
+           "process, default is 'gitpython'"
+    parser.add_argument(
+        '--backend', choices=BACKENDS, help=help, default='gitpython')
+
+    xrefutil.add_stats_arguments(parser)
+
     return parser.parse_args()
 
 ################################################################################
@@ -207,19 +831,47 @@ if __name__ == "__main__":
         sys.exit(1)
 
     args = getargs()
-    rev = args.REV[0]
     repo = args.git_dir
     outfile = args.out
+    cachedir = args.cache_dir
+    update = args.update
+    jobs = args.jobs
+    backend = args.backend
+    branch = args.branch
 
     repo = repo if repo.endswith(".git") else os.path.join(repo, ".git")
     if(not (os.path.isdir(repo))):
         sys.stderr.write("Error: not a git repository: %s\n" % repo)
         sys.exit(1)
 
-    print("[+] Reading commit history, this might take a few minutes")
-    stats = XrefDb(repo, rev)
-    stats.find_references()
-    stats.to_csv(outfile)
-    print("[+] Wrote file: %s" % outfile)
+    try:
+        targets = parse_targets(args.REV, outfile)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    if len(targets) > 1 and (update or branch):
+        sys.stderr.write(
+            "Error: --update and --branch take a single REV\n")
+        sys.exit(1)
+
+    with xrefutil.profiled(args.profile):
+        gitrepo = git.Repo(repo)
+        shared = SharedCommits() if len(targets) > 1 else None
+        print("[+] Reading commit history, this might take a few minutes")
+        for rev, outfile in targets:
+            since = None
+            if update:
+                outfile = update
+                since = update_base(gitrepo, rev, outfile, branch)
+
+            stats = XrefDb(repo, rev, cachedir, since, jobs, backend,
+                           repo=gitrepo, shared=shared)
+            if since:
+                stats.read_upstreamindex(outfile, branch)
+            stats.write(outfile, append=bool(since), branch=branch)
+            stats.write_meta(outfile, branch)
+            print("[+] Wrote file: %s" % outfile)
+
+    xrefutil.output_stats(args)
 
 ################################################################################
@@ -0,0 +1,301 @@
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import json
+import os
+import sqlite3
+import zipfile
+from urllib.parse import quote
+
+from xrefutil import LazyModule
+
+np = LazyModule('numpy')
+
+################################################################################
+
+# Cross-reference database file formats by file name extension. Files with
+# any other extension are CSV.
+FORMATS = {
+    '.csv': 'csv',
+    '.npz': 'npz',
+    '.sqlite': 'sqlite',
+    '.db': 'sqlite',
+}
+
+# Columns holding commit shas, stored as 20-byte binary shas in npz files.
+# Missing shas are stored as all zeros.
+SHA_COLUMNS = [
+    'Commit_hexsha',
+    'Commit_upstream_hexsha',
+    'Refcommit_hexsha',
+    'Refcommit_upstream_hexsha',
+]
+
+# Columns holding commit times, stored as int64 seconds since the epoch in
+# npz files, together with the timezone offset in seconds in column
+# <name>_tzoffset. Missing times are stored as NAT.
+DATETIME_COLUMNS = [
+    'Commit_datetime',
+    'Refcommit_datetime',
+]
+NAT = -2 ** 63  # np.iinfo(np.int64).min
+
+HEXDIGITS = b'0123456789abcdef'
+
+# Key: npy format version, Value: function reading the array header
+NPY_HEADER_READERS = {
+    (1, 0): lambda f: np.lib.format.read_array_header_1_0(f),
+    (2, 0): lambda f: np.lib.format.read_array_header_2_0(f),
+}
+
+# SQLite databases hold the rows of several branches in table 'xref', tagged
+# by the branch name in column Branch. Table 'branches' holds the revision
+# range each branch was built from. Missing shas and times are NULL.
+SQLITE_COLUMNS = [
+    'Commit_datetime',
+    'Commit_hexsha',
+    'Commit_summary',
+    'Commit_upstream_hexsha',
+    'Refcommit_datetime',
+    'Refcommit_hexsha',
+    'Refcommit_upstream_hexsha',
+]
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS xref (
+    Branch TEXT NOT NULL,
+    %s
+);
+CREATE INDEX IF NOT EXISTS xref_branch ON xref (Branch);
+CREATE INDEX IF NOT EXISTS xref_commit ON xref (Commit_hexsha);
+CREATE INDEX IF NOT EXISTS xref_upstream ON xref (Commit_upstream_hexsha);
+CREATE INDEX IF NOT EXISTS xref_refcommit ON xref (Refcommit_hexsha);
+CREATE INDEX IF NOT EXISTS xref_refupstream ON xref (Refcommit_upstream_hexsha);
+CREATE TABLE IF NOT EXISTS branches (
+    Branch TEXT PRIMARY KEY,
+    Meta TEXT NOT NULL
+);
+""" % ",\n    ".join("%s TEXT" % col for col in SQLITE_COLUMNS)
+
+################################################################################
+
+
+def db_format(filename):
+    ext = os.path.splitext(str(filename))[1].lower()
+    return FORMATS.get(ext, 'csv')
+
+
+def write_npz(filename, rows, append=False):
+    # Write the XrefRow values in 'rows' to npz file 'filename'
+    arrays = arrays_from_rows(rows)
+    if append:
+        with np.load(filename) as old:
+            arrays = {
+                key: np.concatenate([old[key], arrays[key]])
+                for key in arrays}
+    # np.savez() would add the extension if it was missing
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def arrays_from_rows(rows):
+    # Return the XrefRow values in 'rows' as the arrays stored in npz files.
+    # The commit summaries are stored as one utf-8 encoded byte array,
+    # together with the byte length of each summary in Commit_summary_len.
+    shas = {col: bytearray() for col in SHA_COLUMNS}
+    times = {col: [] for col in DATETIME_COLUMNS}
+    tzoffsets = {col: [] for col in DATETIME_COLUMNS}
+    summaries = bytearray()
+    summary_lens = []
+    for row in rows:
+        for col in SHA_COLUMNS:
+            sha = getattr(row, col)
+            shas[col] += bytes.fromhex(sha) if sha else bytes(20)
+        for col in DATETIME_COLUMNS:
+            dt = getattr(row, col)
+            times[col].append(int(dt.timestamp()) if dt else NAT)
+            tzoffsets[col].append(
+                int(dt.utcoffset().total_seconds()) if dt else 0)
+        summary = row.Commit_summary.encode('utf-8')
+        summaries += summary
+        summary_lens.append(len(summary))
+
+    arrays = {}
+    for col in SHA_COLUMNS:
+        arrays[col] = np.frombuffer(
+            bytes(shas[col]), dtype=np.uint8).reshape(-1, 20)
+    for col in DATETIME_COLUMNS:
+        arrays[col] = np.array(times[col], dtype=np.int64)
+        arrays['%s_tzoffset' % col] = np.array(tzoffsets[col], dtype=np.int32)
+    arrays['Commit_summary'] = np.frombuffer(bytes(summaries), dtype=np.uint8)
+    arrays['Commit_summary_len'] = np.array(summary_lens, dtype=np.int32)
+    return arrays
+
+
+def read_npz_arrays(filename):
+    # Return the arrays stored in npz file 'filename', see arrays_from_rows()
+    with np.load(filename) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+
+def iter_npz_arrays(filename, chunksize):
+    # Yield the arrays stored in npz file 'filename' in chunks of 'chunksize'
+    # rows, see arrays_from_rows(). Only one chunk at a time is read from
+    # the file: the arrays of the npz file are read in parallel, as streams
+    # of the zip archive.
+    with zipfile.ZipFile(filename) as archive:
+        streams = {}
+        for info in archive.infolist():
+            stream = archive.open(info)
+            version = np.lib.format.read_magic(stream)
+            if version not in NPY_HEADER_READERS:
+                raise ValueError("unsupported npy format version %s in %s" %
+                                 (version, filename))
+            shape, _, dtype = NPY_HEADER_READERS[version](stream)
+            streams[info.filename[:-len('.npy')]] = (stream, shape, dtype)
+
+        rows = streams['Commit_summary_len'][1][0]
+        for start in range(0, rows, chunksize):
+            chunk = {
+                key: read_npy_rows(*streams[key], min(chunksize, rows - start))
+                for key in streams if key != 'Commit_summary'}
+            chunk['Commit_summary'] = read_npy_rows(
+                *streams['Commit_summary'],
+                int(chunk['Commit_summary_len'].sum()))
+            yield chunk
+
+
+def read_npy_rows(stream, shape, dtype, count):
+    # Read the next 'count' rows of the array of 'shape' and 'dtype' from
+    # npy stream 'stream'
+    itemsize = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+    data = stream.read(count * itemsize)
+    return np.frombuffer(data, dtype=dtype).reshape((count,) + shape[1:])
+
+
+def read_npz(filename):
+    # Return the columns of npz file 'filename' as a dictionary of numpy
+    # arrays: shas as hex strings, empty if missing, commit times as
+    # datetime64[s] in UTC, NaT if missing, and summaries as strings
+    columns = {}
+    with np.load(filename) as arrays:
+        for col in SHA_COLUMNS:
+            columns[col] = hexshas(arrays[col])
+        for col in DATETIME_COLUMNS:
+            columns[col] = arrays[col].astype('datetime64[s]')
+            columns['%s_tzoffset' % col] = arrays['%s_tzoffset' % col]
+        data = arrays['Commit_summary'].tobytes()
+        lens = arrays['Commit_summary_len']
+    ends = np.cumsum(lens)
+    columns['Commit_summary'] = np.array(
+        [data[end - length:end].decode('utf-8')
+         for end, length in zip(ends.tolist(), lens.tolist())],
+        dtype=object)
+    return columns
+
+
+def connect_sqlite(filename):
+    # Open SQLite database 'filename' for writing, creating the tables if
+    # needed
+    conn = sqlite3.connect(filename)
+    conn.executescript(SQLITE_SCHEMA)
+    return conn
+
+
+def open_sqlite(filename):
+    # Open the existing SQLite database 'filename' written by xrefdb.py
+    # read-only. Raises ValueError if it is not one.
+    uri = 'file:%s?mode=ro' % quote(os.path.abspath(str(filename)))
+    try:
+        conn = sqlite3.connect(uri, uri=True)
+        tables = set(row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    except sqlite3.DatabaseError as e:
+        raise ValueError("can't read SQLite database %s: %s" % (filename, e))
+    if not {'xref', 'branches'} <= tables:
+        conn.close()
+        raise ValueError("not a SQLite database written by xrefdb.py: %s" %
+                         filename)
+    return conn
+
+
+def write_sqlite(filename, rows, branch, append=False):
+    # Write the XrefRow values in 'rows' to SQLite database 'filename' as
+    # the rows of 'branch', replacing the earlier rows of 'branch' unless
+    # 'append' is set
+    insert = "INSERT INTO xref (Branch, %s) VALUES (?%s)" % (
+        ", ".join(SQLITE_COLUMNS), ", ?" * len(SQLITE_COLUMNS))
+    conn = connect_sqlite(filename)
+    with conn:
+        if not append:
+            conn.execute("DELETE FROM xref WHERE Branch = ?", (branch,))
+        conn.executemany(insert, (
+            [branch] + [str(value) if value else None for value in row]
+            for row in rows))
+    conn.close()
+
+
+def read_sqlite(filename, branch, columns):
+    # Return the values of 'columns' in the rows of 'branch' in SQLite
+    # database 'filename', in the order the rows were written
+    conn = open_sqlite(filename)
+    rows = conn.execute(
+        "SELECT %s FROM xref WHERE Branch = ? ORDER BY rowid" %
+        ", ".join(columns), (branch,)).fetchall()
+    conn.close()
+    return rows
+
+
+def read_sqlite_branches(filename):
+    # Return the names of the branches in SQLite database 'filename'
+    conn = open_sqlite(filename)
+    rows = conn.execute(
+        "SELECT Branch FROM branches ORDER BY Branch").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def write_sqlite_meta(filename, branch, meta):
+    conn = connect_sqlite(filename)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO branches (Branch, Meta) VALUES (?, ?)",
+            (branch, json.dumps(meta)))
+    conn.close()
+
+
+def read_sqlite_meta(filename, branch):
+    # Return the meta data written for 'branch' with write_sqlite_meta(),
+    # raise ValueError if there is none
+    conn = open_sqlite(filename)
+    row = conn.execute(
+        "SELECT Meta FROM branches WHERE Branch = ?", (branch,)).fetchone()
+    conn.close()
+    if not row:
+        raise ValueError("no branch %s in %s" % (branch, filename))
+    return json.loads(row[0])
+
+
+def hexshas(binshas):
+    # Convert an array of 20-byte binary shas to an array of hex strings
+    hexdigits = np.frombuffer(HEXDIGITS, dtype=np.uint8)
+    digits = np.empty((len(binshas), 40), dtype=np.uint8)
+    digits[:, 0::2] = hexdigits[binshas >> 4]
+    digits[:, 1::2] = hexdigits[binshas & 0xf]
+    shas = digits.view('S40').ravel().astype(str)
+    shas[~binshas.any(axis=1)] = ''
+    return shas
+
+
+def binshas(shas):
+    # Convert a sequence of hex strings to an array of 20-byte binary shas,
+    # the inverse of hexshas(). Missing shas, empty or not strings, are
+    # converted to all zeros.
+    text = np.array(
+        [sha if isinstance(sha, str) else '' for sha in shas], dtype='S40')
+    digits = text.view(np.uint8).reshape(-1, 40)
+    values = np.zeros(256, dtype=np.uint8)
+    values[np.frombuffer(HEXDIGITS, dtype=np.uint8)] = np.arange(16)
+    return (values[digits[:, 0::2]] << 4) | values[digits[:, 1::2]]
+
+################################################################################
@@ -8,20 +8,253 @@ import csv
 import os
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
-from tabulate import tabulate
+import xrefformat
+import xrefutil
+from xrefutil import LazyModule, STATS
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+tabulate = LazyModule('tabulate')
 
 ################################################################################
 
+# Ways to find missing commits, by the df_left column matched against
+# df_right.Refcommit_hexsha in missing_fixes_based_on()
+MODES = {
+    # Find missing fixes based on upstream references:
+    # where left.Commit_upstream_hexsha matches right.Refcommit_hexsha.
+    # These are cases where the "Fixes" or "Revert" points back to an
+    # upstream commit.
+    'upstream': 'Commit_upstream_hexsha',
+    # Find missing fixes based on local references:
+    # where left.Commit_hexsha matches right.Refcommit_hexsha.
+    # These are cases where the "Fixes" or "Revert" points back to a local
+    # commit, not an upstream commit.
+    'local': 'Commit_hexsha',
+}
+
+# Columns of the databases, in the order xrefdb.py writes them
+DB_COLUMNS = sorted(
+    xrefformat.SHA_COLUMNS + xrefformat.DATETIME_COLUMNS + ['Commit_summary'])
 
-def df_from_csv_file(name):
-    df = pd.read_csv(name, na_values=['None'], keep_default_na=True)
-    df[['Commit_datetime', 'Refcommit_datetime']] = df[
-        ['Commit_datetime', 'Refcommit_datetime']
-    ].apply(pd.to_datetime, utc=True)
-    df.reset_index(drop=True, inplace=True)
-    return df
+# Columns of df_right compared by missing_fixes_based_on()
+RIGHT_SHAS = ['Commit_hexsha', 'Commit_upstream_hexsha', 'Refcommit_hexsha']
+
+# Number of rows read at a time from the database files
+CHUNKSIZE = 20000
+
+################################################################################
+
+
+class XrefTable:
+    # Cross-reference database in memory, as returned by load_db(). Each
+    # distinct sha is stored once, as a 20-byte binary sha in the sorted
+    # array 'shas', and the sha columns hold the int32 indexes of their
+    # shas in it, -1 if missing. The summary of each commit is stored once,
+    # utf-8 encoded in 'summary_data' at 'summary_offsets', however many
+    # rows the commit has. Commit times are datetime64[s] in UTC, that is,
+    # int64 seconds since the epoch, NaT if missing.
+
+    def __init__(self, shas, codes, summary_index, summary_data,
+                 summary_offsets, times):
+        self.shas = shas
+        # Key: sha column, Value: indexes to 'shas'
+        self.codes = codes
+        # Index of the summary of each row in 'summary_offsets'
+        self.summary_index = summary_index
+        self.summary_data = summary_data
+        self.summary_offsets = summary_offsets
+        # Key: datetime column, Value: datetime64[s] array
+        self.times = times
+
+    def __len__(self):
+        return len(self.summary_index)
+
+    def hexshas(self, codes):
+        # Return the hex strings of the shas at 'codes', None if missing
+        codes = np.asarray(codes)
+        values = np.full(len(codes), None, dtype=object)
+        valid = codes >= 0
+        values[valid] = xrefformat.hexshas(
+            self.shas[codes[valid]].view(np.uint8).reshape(-1, 20))
+        return values
+
+    def summaries(self, rows):
+        # Return the summaries of the rows at positions 'rows'
+        data = self.summary_data
+        starts = self.summary_offsets[:-1].tolist()
+        ends = self.summary_offsets[1:].tolist()
+        return np.array(
+            [data[starts[i]:ends[i]].decode('utf-8')
+             for i in self.summary_index[rows].tolist()], dtype=object)
+
+    def to_frame(self):
+        # Return the database as a DataFrame of strings and datetimes
+        rows = np.arange(len(self))
+        df = pd.DataFrame()
+        for col in DB_COLUMNS:
+            if col in xrefformat.DATETIME_COLUMNS:
+                df[col] = pd.to_datetime(self.times[col], utc=True)
+            elif col == 'Commit_summary':
+                df[col] = self.summaries(rows)
+            else:
+                df[col] = self.hexshas(self.codes[col])
+        return df
+
+
+def load_db(name, branch=None):
+    # Read the database in the format given by the file name extension.
+    # The returned XrefTable is not modified by find_missing(), so it can
+    # be used in any number of comparisons. For SQLite databases, 'branch'
+    # selects the branch, see table_from_sqlite_file().
+    fmt = xrefformat.db_format(name)
+    with STATS.phase('load %s' % fmt) as counts:
+        if fmt == 'npz':
+            table = table_from_npz_file(name)
+        elif fmt == 'sqlite':
+            table = table_from_sqlite_file(name, branch)
+        else:
+            table = table_from_csv_file(name)
+        counts['rows'] = len(table)
+    return table
+
+
+def table_from_npz_file(name):
+    return table_from_arrays(xrefformat.read_npz_arrays(name))
+
+
+def table_from_sqlite_file(name, branch=None):
+    return table_from_columns(sqlite_columns(name, branch))
+
+
+def sqlite_columns(name, branch=None):
+    # Return the columns of branch 'branch' of SQLite database 'name', see
+    # table_from_columns()
+    rows = xrefformat.read_sqlite(
+        name, sqlite_branch(name, branch), DB_COLUMNS)
+    return {col: [row[i] for row in rows] for i, col in enumerate(DB_COLUMNS)}
+
+
+def sqlite_branch(name, branch=None):
+    # Return 'branch', by default the only branch of SQLite database 'name'.
+    # Raises ValueError if there is no such branch, or if 'branch' is not
+    # given and the database holds several branches.
+    branches = xrefformat.read_sqlite_branches(name)
+    if branch is None and len(branches) == 1:
+        branch = branches[0]
+    if branch is None:
+        raise ValueError(
+            "%s holds %d branches, compare them with: xrefquery.py %s "
+            "missing LEFT RIGHT" % (name, len(branches), name))
+    if branch not in branches:
+        raise ValueError("no branch %s in %s" % (branch, name))
+    return branch
+
+
+def table_from_rows(rows):
+    # Build the XrefTable directly from the XrefRow values generated by
+    # xrefdb.XrefDb.find_references(), without a round-trip through a file
+    return table_from_arrays(xrefformat.arrays_from_rows(rows))
+
+
+def table_from_csv_file(name, chunksize=CHUNKSIZE):
+    # The csv file is read in chunks, so that only one chunk at a time is
+    # held as strings
+    arrays = list(iter_db_arrays(name, chunksize))
+    if len(arrays) == 1:
+        return table_from_arrays(arrays[0])
+    if not arrays:
+        arrays = [arrays_from_columns(
+            {col: np.array([], dtype=object) for col in DB_COLUMNS})]
+    return table_from_arrays({
+        key: np.concatenate([chunk[key] for chunk in arrays])
+        for key in arrays[0]})
+
+
+def iter_db_arrays(name, chunksize=CHUNKSIZE):
+    # Yield the rows of database 'name' in chunks of 'chunksize' rows, each
+    # as the arrays of the npz format, see xrefformat.arrays_from_rows()
+    fmt = xrefformat.db_format(name)
+    if fmt == 'npz':
+        yield from xrefformat.iter_npz_arrays(name, chunksize)
+        return
+    if fmt == 'sqlite':
+        # The rows of the branch are read at once
+        yield arrays_from_columns(sqlite_columns(name))
+        return
+    chunks = pd.read_csv(
+        name, na_values=['None'], keep_default_na=True, chunksize=chunksize)
+    for chunk in chunks:
+        yield arrays_from_columns(chunk)
+
+
+def table_from_columns(columns):
+    # Build the XrefTable from the values of each of DB_COLUMNS: shas as
+    # hex strings, empty or None if missing, commit times as anything
+    # pd.to_datetime() accepts, and summaries as strings
+    return table_from_arrays(arrays_from_columns(columns))
+
+
+def arrays_from_columns(columns):
+    # Return the arrays of the npz format, see xrefformat.arrays_from_rows(),
+    # of the columns given to table_from_columns()
+    # Iterating numpy arrays is much faster than iterating pandas columns
+    arrays = {}
+    for col in xrefformat.SHA_COLUMNS:
+        arrays[col] = xrefformat.binshas(
+            np.asarray(columns[col], dtype=object).tolist())
+    for col in xrefformat.DATETIME_COLUMNS:
+        times = pd.to_datetime(pd.Series(columns[col]), utc=True)
+        arrays[col] = times.to_numpy('datetime64[s]').view(np.int64)
+    summaries = [summary.encode('utf-8') if isinstance(summary, str) else b''
+                 for summary in np.asarray(
+                     columns['Commit_summary'], dtype=object).tolist()]
+    arrays['Commit_summary'] = np.frombuffer(
+        b''.join(summaries), dtype=np.uint8)
+    arrays['Commit_summary_len'] = np.array(
+        [len(summary) for summary in summaries], dtype=np.int32)
+    return arrays
+
+
+def table_from_arrays(arrays):
+    # Build the XrefTable from the arrays of the npz format
+    binshas = {
+        col: np.ascontiguousarray(arrays[col]).view('S20').ravel()
+        for col in xrefformat.SHA_COLUMNS}
+    # Missing shas are all zeros, that is, empty 'S20' values
+    valid = {col: values != b'' for col, values in binshas.items()}
+    shas, inverse = np.unique(
+        np.concatenate([binshas[col][valid[col]] for col in binshas]),
+        return_inverse=True)
+    codes = {}
+    start = 0
+    for col in binshas:
+        codes[col] = np.full(len(valid[col]), -1, dtype=np.int32)
+        end = start + np.count_nonzero(valid[col])
+        codes[col][valid[col]] = inverse[start:end]
+        start = end
+
+    # Keep the summary of the first row of each commit only: the rows of a
+    # commit with several references all repeat it
+    lens = arrays['Commit_summary_len']
+    _, first, inverse = np.unique(
+        codes['Commit_hexsha'], return_index=True, return_inverse=True)
+    keep = np.zeros(len(lens), dtype=bool)
+    keep[first] = True
+    summary_data = arrays['Commit_summary'][np.repeat(keep, lens)].tobytes()
+    offsets = np.zeros(len(first) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lens[keep])
+    # The kept summaries are in the order of the rows
+    position = np.cumsum(keep) - 1
+    summary_index = position[first][inverse.ravel()].astype(np.int32)
+
+    times = {
+        col: arrays[col].astype(np.int64).view('datetime64[s]')
+        for col in xrefformat.DATETIME_COLUMNS}
+    return XrefTable(shas, codes, summary_index, summary_data, offsets,
+                     times)
 
 
 def df_to_csv_file(df, name):
@@ -42,83 +275,368 @@ def array_from_blacklist_file(name):
     return matches
 
 
+def find_missing(left_db, right_db, modes=('upstream', 'local'),
+                 transitive=False):
+    # Find commits potentially missing from database left_db based on
+    # commits in right_db, as loaded by load_db(). 'modes' selects the
+    # MODES used for matching. If 'transitive' is set, the fixes of the
+    # missing commits are included too, see missing_fixes_based_on().
+    with STATS.phase('intern shas', rows=len(left_db) + len(right_db)):
+        interned = intern_shas(
+            left_db, [MODES[mode] for mode in modes], right_db, RIGHT_SHAS)
+    frames = []
+    for mode in modes:
+        with STATS.phase('join %s' % mode) as counts:
+            frames.append(missing_fixes_based_on(
+                left_db, MODES[mode], right_db, interned=interned,
+                transitive=transitive))
+            counts['missing'] = len(frames[-1])
+    return pd.concat(frames, ignore_index=True)
+
+
+def find_missing_matrix(left_dbs, right_dbs, modes=('upstream', 'local'),
+                        transitive=False, jobs=1):
+    # Find commits potentially missing from each of the databases left_dbs
+    # based on commits in each of right_dbs, like find_missing() for each
+    # pair. The shas of all the databases are interned once, so each pair
+    # only runs the joins. Up to 'jobs' pairs are compared at the same
+    # time. Returns the results as a list of rows, one for each left
+    # database, of results for each right database.
+    left_cols = [MODES[mode] for mode in modes]
+    rows = sum(len(db) for db in left_dbs) + sum(len(db) for db in right_dbs)
+    with STATS.phase('intern shas', rows=rows):
+        codes, ncodes = intern_tables(
+            [(db, left_cols) for db in left_dbs] +
+            [(db, RIGHT_SHAS) for db in right_dbs])
+    left_codes = codes[:len(left_dbs)]
+    right_codes = codes[len(left_dbs):]
+
+    def compare(i, j):
+        interned = (left_codes[i], right_codes[j], ncodes)
+        frames = []
+        for mode in modes:
+            with STATS.phase('join %s' % mode) as counts:
+                frames.append(missing_fixes_based_on(
+                    left_dbs[i], MODES[mode], right_dbs[j],
+                    interned=interned, transitive=transitive))
+                counts['missing'] = len(frames[-1])
+        return pd.concat(frames, ignore_index=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [[pool.submit(compare, i, j) for j in range(len(right_dbs))]
+                   for i in range(len(left_dbs))]
+    return [[future.result() for future in row] for row in futures]
+
+
+def find_missing_streaming(left_db, right_name, modes=('upstream', 'local'),
+                           chunksize=CHUNKSIZE):
+    # Like find_missing(), but reads the right database from file
+    # 'right_name' in chunks of 'chunksize' rows instead of loading it:
+    # besides left_db, only the last right row referencing each left_db sha
+    # is kept, so the memory use is bounded by the size of left_db.
+    # The results are only known after the last chunk: like in
+    # missing_fixes_based_on(), a later right row referencing the same
+    # commit replaces an earlier one.
+    nshas = len(left_db.shas)
+    left_keys = {mode: left_db.codes[MODES[mode]] for mode in modes}
+    in_left = {}
+    for mode in modes:
+        # Code -1 of missing shas indexes the extra False at the end
+        in_left[mode] = np.zeros(nshas + 1, dtype=bool)
+        in_left[mode][left_keys[mode]] = True
+        in_left[mode][-1] = False
+
+    # The last right row referencing each left_db sha, by left_db code.
+    # Only the fields needed in the results are kept.
+    found = np.zeros(nshas, dtype=bool)
+    missing_upstream = np.zeros(nshas, dtype='S20')
+    missing_stable = np.zeros(nshas, dtype='S20')
+    summaries = np.full(nshas, None, dtype=object)
+    # Key: mode, Value: whether the referencing row is in left_db
+    missing_in_left = {mode: np.zeros(nshas, dtype=bool) for mode in modes}
+
+    with STATS.phase('stream %s' % xrefformat.db_format(right_name)) as \
+            counts:
+        counts['rows'] = counts['chunks'] = 0
+        for arrays in iter_db_arrays(right_name, chunksize):
+            keys = left_codes(left_db, arrays['Refcommit_hexsha'])
+            rows = last_unique(keys)
+            rows = rows[np.any(
+                [in_left[mode][keys[rows]] for mode in modes], axis=0)]
+            if len(rows):
+                binshas = {
+                    col: np.ascontiguousarray(arrays[col]).view('S20').ravel()
+                    for col in ['Commit_hexsha', 'Commit_upstream_hexsha']}
+                commit = binshas['Commit_hexsha'][rows]
+                # Fall back to Commit_hexsha on the shas themselves: a code
+                # of -1 can also mean an upstream sha that is not in left_db
+                upstream = binshas['Commit_upstream_hexsha'][rows]
+                upstream = np.where(upstream == b'', commit, upstream)
+                refs = keys[rows]
+                found[refs] = True
+                missing_stable[refs] = commit
+                missing_upstream[refs] = upstream
+                summaries[refs] = chunk_summaries(arrays, rows)
+                for mode in modes:
+                    vals = upstream if mode == 'upstream' else commit
+                    missing_in_left[mode][refs] = in_left[mode][
+                        left_codes(left_db, vals)]
+            counts['rows'] += len(keys)
+            counts['chunks'] += 1
+
+    frames = []
+    for mode in modes:
+        with STATS.phase('join %s' % mode) as counts:
+            left_sel = last_unique(left_keys[mode])
+            refs = left_keys[mode][left_sel]
+            hit = found[refs] & ~missing_in_left[mode][refs]
+            left_sel, refs = left_sel[hit], refs[hit]
+            frames.append(pd.DataFrame({
+                'Missing_commit_upstream': hexshas_or_none(
+                    missing_upstream[refs]),
+                'Missing_commit_stable': hexshas_or_none(missing_stable[refs]),
+                'Missing_commit_summary': summaries[refs],
+                'Based_on_commit_upstream': left_db.hexshas(
+                    left_db.codes['Commit_upstream_hexsha'][left_sel]),
+                'Based_on_commit_stable': left_db.hexshas(
+                    left_db.codes['Commit_hexsha'][left_sel]),
+            }))
+            counts['missing'] = len(frames[-1])
+    return pd.concat(frames, ignore_index=True)
+
+
+def left_codes(table, binshas):
+    # Return the codes of the binary shas 'binshas', (n, 20) uint8 or 'S20',
+    # in 'table', -1 for the shas not in it
+    values = np.ascontiguousarray(binshas).view('S20').ravel()
+    if not len(table.shas):
+        return np.full(len(values), -1, dtype=np.intp)
+    codes = np.searchsorted(table.shas, values)
+    codes[codes == len(table.shas)] = 0
+    codes[(values == b'') | (table.shas[codes] != values)] = -1
+    return codes
+
+
+def chunk_summaries(arrays, rows):
+    # Return the summaries of 'rows' in the npz format 'arrays'
+    lens = arrays['Commit_summary_len']
+    ends = np.cumsum(lens, dtype=np.int64)
+    data = arrays['Commit_summary'].tobytes()
+    return np.array(
+        [data[end - length:end].decode('utf-8') for end, length in zip(
+            ends[rows].tolist(), lens[rows].tolist())], dtype=object)
+
+
+def hexshas_or_none(binshas):
+    # Return the hex strings of the 'S20' binary shas, None if missing
+    values = xrefformat.hexshas(binshas.view(np.uint8).reshape(-1, 20))
+    return np.where(values == '', None, values.astype(object))
+
+
 def missing_fixes_based_on(
-        left_csv=None, left_col='Commit_upstream_hexsha',
-        right_csv=None, right_col='Refcommit_hexsha'):
-
-    df_left = df_from_csv_file(left_csv)
-    df_right = df_from_csv_file(right_csv)
-
-    # Find unique non-null commits in left_csv.left_col
-    df_left_sel = df_left.drop_duplicates(subset=left_col, keep='last')
-    df_left_sel = df_left_sel[df_left_sel[left_col].notnull()]
-
-    # Find unique non-null commits in right_csv.right_col
-    df_right_sel = df_right.drop_duplicates(subset=right_col, keep='last')
-    df_right_sel = df_right_sel[df_right_sel[right_col].notnull()]
-
-    # For the rows where df_right_sel.Commit_upstream_hexsha value is missing,
-    # use the value from column df_right_sel.Commit_hexsha.
-    # This makes it possible to use non-stable branches in right_csv.
-    colname = 'Commit_upstream_hexsha'
-    df_right_sel.loc[
-        df_right_sel[colname].isnull(), colname] = df_right_sel['Commit_hexsha']
-
-    # Find common commits between left_cvs.left_col and right_csv.right_col
-    # These are the commits fixed in right_csv, where the fixed commit
-    # is included in left_csv
-    df_common = df_left_sel.merge(
-        df_right_sel,
-        how='inner',
-        left_on=[left_col],
-        right_on=[right_col],
-        suffixes=('_left', '_right'),
-    )
-
-    # Select commits from df_common where df_common.left_col_right
-    # is *not* among df_left_sel.left_col
+        df_left, left_col, df_right, right_col='Refcommit_hexsha',
+        interned=None, transitive=False):
+    # The shas are compared as integer codes instead of strings: the codes
+    # index plain numpy arrays that serve as hash tables below. 'interned'
+    # are the codes from intern_shas(), given when the same databases are
+    # compared several times.
+    # If 'transitive' is set, the fixes of the missing commits found in
+    # df_right are reported as missing too, and so on, with column 'Depth'
+    # telling how far down the chain of fixes each missing commit is.
+    if interned is None:
+        interned = intern_shas(
+            df_left, [left_col], df_right, RIGHT_SHAS + [right_col, left_col])
+    left_codes, right_codes, ncodes = interned
+    left_keys = left_codes[left_col]
+    right_keys = right_codes[right_col]
+
+    # For the rows where df_right.Commit_upstream_hexsha value is missing,
+    # use the value from column df_right.Commit_hexsha.
+    # This makes it possible to use non-stable branches in df_right.
+    right_upstream = np.where(
+        right_codes['Commit_upstream_hexsha'] < 0,
+        right_codes['Commit_hexsha'],
+        right_codes['Commit_upstream_hexsha'])
+    right_vals = right_upstream if left_col == 'Commit_upstream_hexsha' \
+        else right_codes[left_col]
+
+    # Find unique non-null commits in df_left.left_col and
+    # df_right.right_col
+    left_sel = last_unique(left_keys)
+    right_sel = last_unique(right_keys)
+
+    # Find common commits between df_left.left_col and df_right.right_col
+    # These are the commits fixed in df_right, where the fixed commit
+    # is included in df_left
+    right_by_code = np.full(ncodes, -1)
+    right_by_code[right_keys[right_sel]] = right_sel
+    common_right = right_by_code[left_keys[left_sel]]
+    common_left = left_sel[common_right >= 0]
+    common_right = common_right[common_right >= 0]
+
+    # Select the common commits where the potentially missing commit
+    # in df_right is *not* among df_left.left_col
     # That is, where the potentially missing commit is not already included
-    # in the left_csv.
-    # After this merge and filter, we are left with commits  that are
-    # potentially missing from left_csv
-    df_missing = df_common.merge(
-        df_left_sel,
-        how='left',
-        left_on=['%s_right' % left_col],
-        right_on=[left_col],
-        indicator=True,
-    )
-    df_missing = df_missing[df_missing['_merge'] == 'left_only']
-
-    # Select only the relevant fields from df_missing
-    df_missing = df_missing[
-        [
-            'Commit_upstream_hexsha_right',
-            'Commit_hexsha_right',
-            'Commit_summary_right',
-            'Commit_upstream_hexsha_left',
-            'Commit_hexsha_left',
-        ]
-    ]
-    # Rename the selected columns
-    df_missing.columns = [
-        'Missing_commit_upstream',
-        'Missing_commit_stable',
-        'Missing_commit_summary',
-        'Based_on_commit_upstream',
-        'Based_on_commit_stable',
-    ]
-
-    return df_missing
+    # in df_left.
+    in_left = np.zeros(ncodes + 1, dtype=bool)
+    in_left[left_keys[left_sel]] = True
+    # Missing values have code -1, which indexes the extra False at the end
+    missing = ~in_left[right_vals[common_right]]
+    common_left = common_left[missing]
+    common_right = common_right[missing]
+
+    # Select only the relevant fields
+    df = missing_frame(
+        df_right, common_right,
+        df_left.hexshas(df_left.codes['Commit_upstream_hexsha'][common_left]),
+        df_left.hexshas(df_left.codes['Commit_hexsha'][common_left]))
+    if not transitive:
+        return df
+
+    with STATS.phase('fix chains') as counts:
+        fixes, fixed, depths = follow_fix_chains(
+            right_codes['Commit_hexsha'], right_upstream, right_vals,
+            right_by_code, in_left, common_right)
+        counts['missing'] = len(fixes)
+    # The chained fixes are based on missing commits, which are not in
+    # df_left and so have no stable hexsha
+    chained = missing_frame(
+        df_right, fixes, upstream_hexshas(df_right, fixed),
+        np.full(len(fixes), None, dtype=object))
+    df['Depth'] = 1
+    chained['Depth'] = depths
+    return pd.concat([df, chained], ignore_index=True)
+
+
+def missing_frame(df_right, rows, based_on_upstream, based_on_stable):
+    # Return the result rows of the missing commits at positions 'rows' of
+    # df_right, and the commits they are based on
+    return pd.DataFrame({
+        'Missing_commit_upstream': upstream_hexshas(df_right, rows),
+        'Missing_commit_stable':
+            df_right.hexshas(df_right.codes['Commit_hexsha'][rows]),
+        'Missing_commit_summary': df_right.summaries(rows),
+        'Based_on_commit_upstream': based_on_upstream,
+        'Based_on_commit_stable': based_on_stable,
+    })
+
+
+def upstream_hexshas(table, rows):
+    # Return the upstream hexshas of the rows at positions 'rows' of
+    # 'table', or their hexshas if they have no upstream hexsha
+    upstream = table.codes['Commit_upstream_hexsha'][rows]
+    return table.hexshas(np.where(
+        upstream < 0, table.codes['Commit_hexsha'][rows], upstream))
+
+
+def follow_fix_chains(
+        right_commit, right_upstream, right_vals, right_by_code, in_left,
+        missing):
+    # Walk the Refcommit_hexsha -> Commit_hexsha edges of df_right
+    # breadth-first, starting from the missing commits at positions
+    # 'missing' of df_right: a commit fixing a missing commit is missing
+    # too, unless it is already in df_left. Like in
+    # missing_fixes_based_on(), right_by_code gives the last df_right row
+    # referencing each code, so each level is one round of array lookups.
+    # Returns the df_right positions of the missing fixes found and of the
+    # commits they fix, and the depth of each fix in its chain, the commits
+    # in 'missing' being at depth 1.
+    # Each missing commit is reported once, by its upstream code, which
+    # also stops the walk on reference cycles
+    reported = np.zeros(len(in_left), dtype=bool)
+    reported[right_upstream[missing]] = True
+    reported[-1] = False
+    frontier = np.asarray(missing, dtype=np.intp)
+    fixes, fixed, depths = [frontier[:0]], [frontier[:0]], [frontier[:0]]
+    depth = 1
+    while len(frontier):
+        depth += 1
+        # A missing commit can be referenced with its local or its upstream
+        # hexsha: look up both, in the order of the frontier
+        upstream = np.where(
+            right_upstream[frontier] == right_commit[frontier], -1,
+            right_upstream[frontier])
+        refs = np.stack([right_commit[frontier], upstream], axis=1).ravel()
+        parents = np.repeat(frontier, 2)
+        parents, refs = parents[refs >= 0], refs[refs >= 0]
+        children = right_by_code[refs]
+        parents, children = parents[children >= 0], children[children >= 0]
+        new = ~in_left[right_vals[children]] & \
+            ~reported[right_upstream[children]]
+        parents, children = parents[new], children[new]
+        # Several missing commits can have the same fix: keep the first
+        _, first = np.unique(right_upstream[children], return_index=True)
+        first = np.sort(first)
+        parents, children = parents[first], children[first]
+        reported[right_upstream[children]] = True
+        fixes.append(children)
+        fixed.append(parents)
+        depths.append(np.full(len(children), depth))
+        frontier = children
+    return (np.concatenate(fixes), np.concatenate(fixed),
+            np.concatenate(depths))
+
+
+def intern_shas(df_left, left_cols, df_right, right_cols):
+    # Map the shas in columns 'left_cols' of df_left and 'right_cols' of
+    # df_right to integer codes shared by all the columns, so that equal
+    # shas get equal codes. Missing values get code -1. Returns the codes
+    # of each left and right column, and the number of distinct codes.
+    (left, right), ncodes = intern_tables(
+        [(df_left, left_cols), (df_right, right_cols)])
+    return left, right, ncodes
+
+
+def intern_tables(tables):
+    # Like intern_shas(), for any number of (XrefTable, columns) pairs:
+    # returns the codes of the columns of each pair, and the number of
+    # distinct codes. Each table already has its shas interned, so only
+    # the tables' sorted sha arrays are merged, not the columns.
+    shas, inverse = np.unique(
+        np.concatenate([table.shas for table, _ in tables]),
+        return_inverse=True)
+    codes = []
+    start = 0
+    for table, cols in tables:
+        # Code -1 of missing shas indexes the -1 at the end
+        remap = np.append(inverse[start:start + len(table.shas)], -1)
+        start += len(table.shas)
+        codes.append({col: remap[table.codes[col]] for col in cols})
+    return codes, len(shas)
+
+
+def last_unique(codes):
+    # Return the positions of the last occurrence of each non-missing code,
+    # in increasing order, like drop_duplicates(keep='last') and notnull()
+    _, first_in_reversed = np.unique(codes[::-1], return_index=True)
+    positions = np.sort(len(codes) - 1 - first_in_reversed)
+    return positions[codes[positions] >= 0]
 
 
 def remove_blacklisted(df, blacklist_file, col='Missing_commit_upstream'):
     blacklist = array_from_blacklist_file(blacklist_file)
     if blacklist:
-        df = df[~df[col].str.contains('|'.join(blacklist))]
+        with STATS.phase('blacklist filter', rows=len(df)) as counts:
+            matches = startswith_any(df[col], blacklist)
+            df = df[~matches]
+            counts['removed'] = int(matches.sum())
     return df
 
 
+def startswith_any(shas, prefixes):
+    # Return a boolean array telling which of the shas in Series 'shas'
+    # start with any of the sha 'prefixes'. The prefixes are grouped by
+    # length, so each sha is looked up in one hash set per prefix length,
+    # regardless of the number of prefixes.
+    prefixes_by_len = {}
+    for prefix in prefixes:
+        prefixes_by_len.setdefault(len(prefix), set()).add(prefix)
+    matches = np.zeros(len(shas), dtype=bool)
+    for length, group in prefixes_by_len.items():
+        matches |= shas.str.slice(0, length).isin(group).to_numpy()
+    return matches
+
+
 def output(dfo, left_name, right_name, outname):
 
     df = dfo.copy()
@@ -154,7 +672,7 @@ def output(dfo, left_name, right_name, outname):
         'Missing_commit',
         'Missing_commit_summary',
         'Based_on_commit',
-    ]]
+    ] + (['Depth'] if 'Depth' in df else [])]
 
     # Truncate the values
     df['Missing_commit'] = df['Missing_commit'].str.slice(0, 12)
@@ -162,10 +680,58 @@ def output(dfo, left_name, right_name, outname):
     df['Based_on_commit'] = df['Based_on_commit'].str.slice(0, 12)
 
     print("")
-    print(tabulate(df, headers='keys', tablefmt='simple', showindex=False))
+    print(tabulate.tabulate(df, headers='keys', tablefmt='simple', showindex=False))
+    print("")
+
+
+def output_matrix(left_names, right_names, outdir, blacklist=None,
+                  transitive=False, jobs=1):
+    # Compare each of the databases 'left_names' against each of the
+    # databases 'right_names', writing the results of each pair and a
+    # summary of all pairs to folder 'outdir'. A database given twice is
+    # compared only once.
+    left_names = list(dict.fromkeys(left_names))
+    right_names = list(dict.fromkeys(right_names))
+    print("[+] Reading input files, this might take a few minutes")
+    loaded = {}
+    for name in left_names + right_names:
+        if name not in loaded:
+            loaded[name] = load_db(name)
+    matrix = find_missing_matrix(
+        [loaded[name] for name in left_names],
+        [loaded[name] for name in right_names],
+        transitive=transitive, jobs=jobs)
+
+    os.makedirs(outdir, exist_ok=True)
+    summary = []
+    for left_name, row in zip(left_names, matrix):
+        for right_name, df in zip(right_names, row):
+            df = remove_blacklisted(df, blacklist)
+            outname = os.path.join(outdir, "missing_%s_%s.csv" % (
+                db_stem(left_name), db_stem(right_name)))
+            with STATS.phase('output', rows=len(df)):
+                output(df, left_name, right_name, outname)
+            summary.append((left_name, right_name, len(df)))
+
+    df = pd.DataFrame(summary, columns=['Left', 'Right', 'Missing'])
+    df_to_csv_file(df, os.path.join(outdir, "summary.csv"))
+    # Number of missing commits of each pair, left databases on the rows
+    # and right databases on the columns
+    table = df.pivot(index='Left', columns='Right', values='Missing')
+    table = table.loc[left_names, right_names]
+    table.index = [os.path.basename(name) for name in table.index]
+    table.columns = [os.path.basename(name) for name in table.columns]
+    print("[+] Number of potentially missing commits:")
+    print("")
+    print(tabulate.tabulate(table, headers='keys', tablefmt='simple'))
     print("")
 
 
+def db_stem(name):
+    # Database file name without the folder and the extension
+    return os.path.splitext(os.path.basename(name))[0]
+
+
 def exit_unless_accessible(filename):
     if not os.path.isfile(filename):
         sys.stderr.write(
@@ -173,6 +739,19 @@ def exit_unless_accessible(filename):
         sys.exit(1)
 
 
+def exit_unless_loadable(filename):
+    # SQLite databases can only be compared if they hold a single branch,
+    # see sqlite_branch()
+    exit_unless_accessible(filename)
+    if xrefformat.db_format(filename) != 'sqlite':
+        return
+    try:
+        sqlite_branch(filename)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+
 def getargs():
     desc = \
         "Script finds potentially missing commits from "\
@@ -185,7 +764,10 @@ def getargs():
         "potentially missing from branch CSV1. "\
         "Note: the produced list of missing patches requires "\
         "manual effort to find out if the found missing patches "\
-        "would actually apply to branch CSV1."
+        "would actually apply to branch CSV1. "\
+        "To compare several branches against several reference "\
+        "branches at once, give the databases with --left and --right "\
+        "instead of CSV1 and CSV2."
 
     epil = "Example: ./%s linux-stable-rc.csv linux-next.csv" % \
         os.path.basename(__file__)
@@ -194,14 +776,16 @@ def getargs():
     help = \
         "CSV database for the branch which will be checked for "\
         "potential missing commits "\
-        "(output from xrefdb.py)"
-    parser.add_argument('CSV1', nargs=1, help=help)
+        "(output from xrefdb.py, in csv or npz format, or a SQLite "\
+        "database holding a single branch)"
+    parser.add_argument('CSV1', nargs='?', help=help)
 
     help = \
         "CSV database for the branch which will used as reference "\
         "to find potential missing commits from CSV1 "\
-        "(output from xrefdb.py)"
-    parser.add_argument('CSV2', nargs=1, help=help)
+        "(output from xrefdb.py, in csv or npz format, or a SQLite "\
+        "database holding a single branch)"
+    parser.add_argument('CSV2', nargs='?', help=help)
 
     help = "set the blacklist file name; blacklist file is a text file "\
            "that lists the CSV2 commit hexshas that are intentionally "\
@@ -213,6 +797,40 @@ def getargs():
     help = "set the output file name, default is 'missing.csv'"
     parser.add_argument('--out', nargs='?', help=help, default='missing.csv')
 
+    help = "also find the commits in CSV2 that fix the potentially missing "\
+           "commits, and the commits that fix those, and so on. Column "\
+           "'Depth' tells the position of each missing commit in its "\
+           "chain of fixes: 1 for the commits that fix commits in CSV1, "\
+           "2 for their fixes, and so on"
+    parser.add_argument('--transitive', action='store_true', help=help)
+
+    help = "read CSV2 in chunks instead of loading it into memory, so that "\
+           "the memory use is bounded by the size of CSV1: use this when "\
+           "CSV2 is a database of a long history such as linux-next. "\
+           "Can not be used with --transitive, --left or --right"
+    parser.add_argument('--streaming', action='store_true', help=help)
+
+    help = "databases of the branches which will be checked for "\
+           "potential missing commits, each against each of the --right "\
+           "databases. Each database is read only once"
+    parser.add_argument('--left', nargs='+', help=help)
+
+    help = "databases of the branches which will be used as reference to "\
+           "find potential missing commits from the --left databases"
+    parser.add_argument('--right', nargs='+', help=help)
+
+    help = "with --left and --right, set the folder of the output files, "\
+           "default is 'missing'. The missing commits of each pair of "\
+           "databases are written to file 'missing_LEFT_RIGHT.csv' and "\
+           "the number of missing commits of all pairs to 'summary.csv'"
+    parser.add_argument('--out-dir', nargs='?', help=help, default='missing')
+
+    help = "with --left and --right, compare up to JOBS pairs of "\
+           "databases at the same time, default is 1"
+    parser.add_argument('-j', '--jobs', type=xrefutil.positive_int, help=help, default=1)
+
+    xrefutil.add_stats_arguments(parser)
+
     return parser.parse_args()
 
 ################################################################################
@@ -224,42 +842,66 @@ if __name__ == "__main__":
         sys.exit(1)
 
     args = getargs()
-    left = args.CSV1[0]
-    right = args.CSV2[0]
+    left = args.CSV1
+    right = args.CSV2
     out = args.out
     blacklist = args.blacklist
 
-    exit_unless_accessible(left)
-    exit_unless_accessible(right)
+    if args.left or args.right:
+        if not (args.left and args.right) or left or right:
+            sys.stderr.write(
+                "Error: give either CSV1 and CSV2, or --left and --right\n")
+            sys.exit(1)
+        for names in [args.left, args.right]:
+            names = set(names)
+            for name in names:
+                exit_unless_loadable(name)
+            if len(set(db_stem(name) for name in names)) != len(names):
+                sys.stderr.write(
+                    "Error: databases with the same file name: %s\n" %
+                    " ".join(sorted(names)))
+                sys.exit(1)
+    elif not (left and right):
+        sys.stderr.write("Error: CSV1 and CSV2 are required\n")
+        sys.exit(1)
+    else:
+        exit_unless_loadable(left)
+        exit_unless_loadable(right)
     if blacklist:
         exit_unless_accessible(blacklist)
+    if args.streaming and (args.transitive or args.left):
+        sys.stderr.write(
+            "Error: --streaming can not be used with --transitive, --left "
+            "or --right\n")
+        sys.exit(1)
 
-    print("[+] Reading input csv files, this might take a few minutes")
-
-    # Find missing fixes based on upstream references:
-    # where left.Commit_upstream_hexsha matches right.Refcommit_hexsha.
-    # These are cases where the "Fixes" or "Revert" points back to an upstream
-    # commit.
-    df_upstream = missing_fixes_based_on(
-        left, "Commit_upstream_hexsha",
-        right, "Refcommit_hexsha"
-    )
-
-    # Find missing fixes based on local references:
-    # where left.Commit_hexsha matches right.Refcommit_hexsha.
-    # These are cases where the "Fixes" or "Revert" points back to a local
-    # commit, not an upstream commit.
-    df_local = missing_fixes_based_on(
-        left, "Commit_hexsha",
-        right, "Refcommit_hexsha"
-    )
-
-    df = pd.concat([df_upstream, df_local])
-
-    # Remove blacklisted entries
-    df = remove_blacklisted(df, blacklist)
-
-    # Output table and csv-file
-    output(df, left, right, out)
+    with xrefutil.profiled(args.profile):
+        if args.left:
+            # Compare each --left database against each --right database
+            output_matrix(args.left, args.right, args.out_dir, blacklist,
+                          args.transitive, args.jobs)
+        else:
+            print("[+] Reading input csv files, this might take a few "
+                  "minutes")
+            left_db = load_db(left)
+
+            # Find missing fixes based on both upstream and local references
+            if args.streaming:
+                df = find_missing_streaming(
+                    left_db, right, modes=['upstream', 'local'])
+            else:
+                right_db = load_db(right)
+                df = find_missing(
+                    left_db, right_db, modes=['upstream', 'local'],
+                    transitive=args.transitive)
+
+            # Remove blacklisted entries
+            df = remove_blacklisted(df, blacklist)
+
+            # Output table and csv-file
+            with STATS.phase('output', rows=len(df)):
+                output(df, left, right, out)
+
+    xrefutil.output_stats(args)
 
 ################################################################################
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import argparse
+import json
+import os
+import re
+import sys
+
+import xrefformat
+import xrefmissing
+from xrefutil import LazyModule
+
+pd = LazyModule('pandas')
+tabulate = LazyModule('tabulate')
+
+################################################################################
+
+RE_SHA = re.compile(r'^[0-9a-f]{4,40}$')
+
+# Commits in the xref table: each commit appears once for each of its
+# references, so the rows are grouped by commit
+COMMIT_SQL = """
+SELECT Branch, Commit_hexsha, Commit_upstream_hexsha, Commit_summary
+FROM xref
+WHERE ((Commit_hexsha >= :lo AND Commit_hexsha < :hi) OR
+       (Commit_upstream_hexsha >= :lo AND Commit_upstream_hexsha < :hi))
+      AND (:branch IS NULL OR Branch = :branch)
+GROUP BY Branch, Commit_hexsha
+ORDER BY Branch, MIN(rowid)
+"""
+
+FIXES_SQL = """
+SELECT Branch, Commit_hexsha, Commit_upstream_hexsha, Commit_summary,
+       Refcommit_hexsha
+FROM xref
+WHERE ((Refcommit_hexsha >= :lo AND Refcommit_hexsha < :hi) OR
+       (Refcommit_upstream_hexsha >= :lo AND
+        Refcommit_upstream_hexsha < :hi))
+      AND (:branch IS NULL OR Branch = :branch)
+ORDER BY Branch, rowid
+"""
+
+BRANCHES_SQL = """
+SELECT branches.Branch, branches.Meta, COUNT(xref.rowid)
+FROM branches LEFT JOIN xref ON xref.Branch = branches.Branch
+GROUP BY branches.Branch
+ORDER BY branches.Branch
+"""
+
+# The join in xrefmissing.missing_fixes_based_on() over the indexed columns:
+# the last row of each non-null {left_col} in branch :left joined with the
+# last row of each non-null Refcommit_hexsha in branch :right, leaving out
+# the fixes whose {right_val} is already in branch :left
+MISSING_SQL = """
+WITH
+    left_sel AS (
+        SELECT rowid AS pos, * FROM xref WHERE rowid IN (
+            SELECT MAX(rowid) FROM xref
+            WHERE Branch = :left AND {left_col} IS NOT NULL
+            GROUP BY {left_col})),
+    right_sel AS (
+        SELECT *, COALESCE(Commit_upstream_hexsha, Commit_hexsha) AS Upstream
+        FROM xref WHERE rowid IN (
+            SELECT MAX(rowid) FROM xref
+            WHERE Branch = :right AND Refcommit_hexsha IS NOT NULL
+            GROUP BY Refcommit_hexsha))
+SELECT
+    r.Upstream AS Missing_commit_upstream,
+    r.Commit_hexsha AS Missing_commit_stable,
+    r.Commit_summary AS Missing_commit_summary,
+    l.Commit_upstream_hexsha AS Based_on_commit_upstream,
+    l.Commit_hexsha AS Based_on_commit_stable
+FROM left_sel AS l
+JOIN right_sel AS r ON r.Refcommit_hexsha = l.{left_col}
+WHERE NOT EXISTS (
+    SELECT 1 FROM xref WHERE Branch = :left AND {left_col} = {right_val})
+ORDER BY l.pos
+"""
+
+################################################################################
+
+
+def prefix_range(sha):
+    # Return the range of strings starting with 'sha', so that prefix
+    # lookups can use the column indexes: all hex digits sort before 'g'
+    return {'lo': sha, 'hi': sha + 'g'}
+
+
+def query_branches(conn):
+    rows = []
+    for branch, meta, count in conn.execute(BRANCHES_SQL):
+        rows.append((branch, json.loads(meta).get('rev'), count))
+    return rows
+
+
+def query_commit(conn, sha, branch=None):
+    return conn.execute(
+        COMMIT_SQL, dict(prefix_range(sha), branch=branch)).fetchall()
+
+
+def query_fixes(conn, sha, branch=None):
+    return conn.execute(
+        FIXES_SQL, dict(prefix_range(sha), branch=branch)).fetchall()
+
+
+def query_missing(conn, left, right, modes=('upstream', 'local')):
+    # Find commits potentially missing from branch 'left' based on commits
+    # in branch 'right', like xrefmissing.find_missing()
+    frames = []
+    for mode in modes:
+        left_col = xrefmissing.MODES[mode]
+        right_val = "r.Upstream" if left_col == 'Commit_upstream_hexsha' \
+            else "r.%s" % left_col
+        sql = MISSING_SQL.format(left_col=left_col, right_val=right_val)
+        cursor = conn.execute(sql, {'left': left, 'right': right})
+        frames.append(pd.DataFrame(
+            cursor.fetchall(),
+            columns=[desc[0] for desc in cursor.description]))
+    return pd.concat(frames, ignore_index=True)
+
+
+def exit_unless_branch(conn, branch, dbname):
+    if not conn.execute(
+            "SELECT 1 FROM branches WHERE Branch = ?", (branch,)).fetchone():
+        sys.stderr.write(
+            "Error: branch \"%s\" not found in %s\n" % (branch, dbname))
+        sys.exit(1)
+
+
+def exit_unless_sha(sha):
+    if not RE_SHA.match(sha):
+        sys.stderr.write(
+            "Error: not a commit hexsha or hexsha prefix: %s\n" % sha)
+        sys.exit(1)
+
+
+def print_rows(rows, headers):
+    if not rows:
+        print("No matching commits")
+        return
+    print(tabulate.tabulate(rows, headers=headers, tablefmt='simple'))
+
+
+def getargs():
+    desc = \
+        "Query the SQLite cross-reference database DB written by "\
+        "xrefdb.py (--out FILE.sqlite). Command 'branches' lists the "\
+        "branches stored in DB, 'commit' finds the commits whose hexsha "\
+        "or upstream hexsha starts with SHA, 'fixes' finds the commits "\
+        "that fix or revert commit SHA, given as local or upstream "\
+        "hexsha, and 'missing' finds commits "\
+        "potentially missing from branch LEFT based on commits in branch "\
+        "RIGHT, like xrefmissing.py."
+
+    epil = "Example: ./%s xref.sqlite commit --branch v4.19 ca9033ba69c7" % \
+        os.path.basename(__file__)
+    parser = argparse.ArgumentParser(description=desc, epilog=epil)
+
+    help = "SQLite database written by xrefdb.py"
+    parser.add_argument('DB', help=help)
+
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    commands.add_parser('branches', help="list the branches in DB")
+
+    help = "find commits by hexsha or upstream hexsha"
+    cmd = commands.add_parser('commit', help=help)
+    cmd.add_argument('SHA', help="commit hexsha or hexsha prefix")
+    cmd.add_argument(
+        '--branch', nargs='?', help="only search branch BRANCH")
+
+    help = "find commits that fix or revert a commit"
+    cmd = commands.add_parser('fixes', help=help)
+    cmd.add_argument('SHA', help="commit hexsha or hexsha prefix")
+    cmd.add_argument(
+        '--branch', nargs='?', help="only search branch BRANCH")
+
+    help = "find commits potentially missing from a branch"
+    cmd = commands.add_parser('missing', help=help)
+    help = "branch which will be checked for potential missing commits"
+    cmd.add_argument('LEFT', help=help)
+    help = "branch which will used as reference to find potential "\
+           "missing commits from LEFT"
+    cmd.add_argument('RIGHT', help=help)
+    help = "set the blacklist file name, see xrefmissing.py"
+    cmd.add_argument('--blacklist', nargs='?', help=help)
+    help = "set the output file name, default is 'missing.csv'"
+    cmd.add_argument('--out', nargs='?', help=help, default='missing.csv')
+
+    return parser.parse_args()
+
+################################################################################
+
+
+if __name__ == "__main__":
+    if sys.version_info[0] < 3:
+        sys.stderr.write("Error: script requires Python 3.x\n")
+        sys.exit(1)
+
+    args = getargs()
+    dbname = args.DB
+
+    xrefmissing.exit_unless_accessible(dbname)
+    try:
+        conn = xrefformat.open_sqlite(dbname)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+    if args.command == 'branches':
+        print_rows(query_branches(conn), ['Branch', 'Revision', 'Rows'])
+
+    elif args.command in ('commit', 'fixes'):
+        exit_unless_sha(args.SHA)
+        if args.branch:
+            exit_unless_branch(conn, args.branch, dbname)
+        if args.command == 'commit':
+            rows = query_commit(conn, args.SHA, args.branch)
+            headers = ['Branch', 'Commit_hexsha', 'Commit_upstream_hexsha',
+                       'Commit_summary']
+        else:
+            rows = query_fixes(conn, args.SHA, args.branch)
+            headers = ['Branch', 'Commit_hexsha', 'Commit_upstream_hexsha',
+                       'Commit_summary', 'Refcommit_hexsha']
+        print_rows(rows, headers)
+
+    elif args.command == 'missing':
+        exit_unless_branch(conn, args.LEFT, dbname)
+        exit_unless_branch(conn, args.RIGHT, dbname)
+        if args.blacklist:
+            xrefmissing.exit_unless_accessible(args.blacklist)
+        df = query_missing(conn, args.LEFT, args.RIGHT)
+        df = xrefmissing.remove_blacklisted(df, args.blacklist)
+        xrefmissing.output(df, args.LEFT, args.RIGHT, args.out)
+
+    conn.close()
+
+################################################################################
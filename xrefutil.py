@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: 2020 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# SPDX-License-Identifier: GPL-2.0-only
+
+import argparse
+import importlib
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then not reported
+    resource = None
+
+################################################################################
+
+
+class LazyModule:
+    # Stands in for module 'name', which is imported when one of its
+    # attributes is first used. The scripts import their heavy dependencies
+    # (GitPython, numpy, pandas, tabulate) this way, so that --help and
+    # argument errors do not have to wait for them.
+
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        # Only called for attributes not yet copied from the module
+        with LazyModule._lock:
+            module = importlib.import_module(self._name)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self._name
+
+################################################################################
+
+
+class Stats:
+    # Wall time and counts of the phases of a run, reported with --stats.
+    # A phase can run several times, for instance once per input file;
+    # its time and counts are then summed. Phases may nest: the time of
+    # the inner phase is included in the time of the outer phase.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Key: phase name, Value: dict of seconds, calls and counts, in the
+        # order the phases first ran
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **counts):
+        # Time the block as phase 'name'. The block can add counts to the
+        # yielded dictionary, such as the number of commits it processed.
+        counts = dict(counts)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(name, time.perf_counter() - start, **counts)
+
+    def add(self, name, seconds, calls=1, **counts):
+        with self.lock:
+            phase = self.phases.setdefault(
+                name, {'seconds': 0.0, 'calls': 0, 'counts': {}})
+            phase['seconds'] += seconds
+            phase['calls'] += calls
+            for key, value in counts.items():
+                phase['counts'][key] = phase['counts'].get(key, 0) + value
+
+    def as_dict(self):
+        phases = []
+        for name, phase in self.phases.items():
+            rates = {}
+            if phase['seconds'] > 0:
+                rates = {
+                    key: value / phase['seconds']
+                    for key, value in phase['counts'].items()
+                    if key in RATE_COUNTS}
+            phases.append(dict(
+                phase, name=name, counts=dict(phase['counts']),
+                per_second=rates))
+        return {
+            'wall_seconds': time.perf_counter() - self.start,
+            'peak_rss_kb': peak_rss_kb(),
+            'peak_rss_children_kb': peak_rss_kb(children=True),
+            'phases': phases,
+        }
+
+    def report(self):
+        stats = self.as_dict()
+        print("[+] Stats:")
+        print("%-24s %6s %9s  %s" % ("Phase", "Calls", "Seconds", "Counts"))
+        for phase in stats['phases']:
+            counts = ", ".join(
+                "%s=%d (%.0f/s)" % (key, value, phase['per_second'][key])
+                if key in phase['per_second'] else "%s=%d" % (key, value)
+                for key, value in phase['counts'].items())
+            print("%-24s %6d %9.3f  %s" % (
+                phase['name'], phase['calls'], phase['seconds'], counts))
+        print("%-24s %6s %9.3f" % ("Total", "", stats['wall_seconds']))
+        if stats['peak_rss_kb'] is not None:
+            print("Peak RSS: %.1f MB, child processes: %.1f MB" % (
+                stats['peak_rss_kb'] / 1024,
+                stats['peak_rss_children_kb'] / 1024))
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+        print("[+] Wrote stats: %s" % filename)
+
+
+# Stats of the current process
+STATS = Stats()
+
+# Counts reported also per second
+RATE_COUNTS = ['commits', 'rows', 'shas']
+
+
+def peak_rss_kb(children=False):
+    # Peak resident set size in kilobytes of this process, or of its
+    # terminated child processes
+    if not resource:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    return maxrss
+
+
+@contextmanager
+def profiled(filename):
+    # Write cProfile data of the block to 'filename', if it is set. The
+    # data can be read with the pstats module or tools like snakeviz.
+    if not filename:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+        print("[+] Wrote profile: %s" % filename)
+
+
+def positive_int(value):
+    # argparse type of options such as --jobs that must be at least 1
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "expected a positive integer, got '%s'" % value)
+    return number
+
+
+def add_stats_arguments(parser):
+    # Add the --stats, --stats-json and --profile options to 'parser'
+    help = "print the wall time and counts of each phase of the run, "\
+           "and the peak memory use"
+    parser.add_argument('--stats', action='store_true', help=help)
+
+    help = "write the stats printed with --stats to file STATS_JSON "\
+           "in json format"
+    parser.add_argument('--stats-json', nargs='?', help=help)
+
+    help = "write cProfile profiling data of the run to file PROFILE"
+    parser.add_argument('--profile', nargs='?', help=help)
+
+
+def output_stats(args):
+    # Output the stats as requested with the add_stats_arguments() options
+    if args.stats:
+        STATS.report()
+    if args.stats_json:
+        STATS.write_json(args.stats_json)
+
+################################################################################